@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+"""Atomic writes of whole files
+
+Data goes to a temporary file next to the target first, which then replaces
+it. Concurrent readers never see a partial file and a failed write leaves the
+old one in place"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from tempfile import mkstemp
+import json
+import os
+
+
+def write(filename, data):
+    """Replaces filename by the bytes data"""
+    fd, tmp = mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def loadJSON(filename, default=None):
+    """Returns the JSON value saved in filename or default if there is no such file"""
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+def saveJSON(filename, value):
+    write(filename, json.dumps(value, ensure_ascii=False, sort_keys=True).encode('utf-8'))
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+"""Benchmarks for the hot paths of the crawlers
+
+Runs on synthetic data only, see syntheticData, at several scales of streets.
+The end to end benchmark crawls a local StubServer standing in for the AWS
+and Overpass endpoints, so nothing touches the network. Results can be saved
+as a JSON baseline and later runs compared against it"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from time import perf_counter
+from contextlib import contextmanager, redirect_stdout
+from datetime import date as Date
+from tempfile import TemporaryDirectory
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+from urllib.parse import unquote
+from uuid import uuid4
+from street import Street
+from multiline import Multiline
+from random import Random
+from spatialIndex import SpatialIndex
+from scheduleEngine import ScheduleEngine
+from overpassData import OverpassData, TileError
+from crawlStreetData import StreetCrawler
+from crawlTrashCollections import AwsCrawler, writeCollections
+from fetcher import Fetcher
+from responseCache import ResponseCache
+from stubServer import StubServer
+from syntheticData import getStreetNames, getStreets, getAwsPages, getOverpassXML, writeStreetsCSV
+
+
+def legacyNormalizeName(name):
+    """The original chained implementation of Street.normalizeName, kept as reference"""
+    normalized = name.lower().replace('ä', 'ae').replace('ö', 'oe').replace('ü', 'ue').replace('ß', 'ss').replace('*', '').replace(' ab ', '').replace('-', ' ').replace('ç', 'c')
+    normalized = re.sub(r'\(.*?\)', '', normalized)
+    normalized = re.match(r'.\D+', normalized).group(0).strip()
+    normalized = re.sub(r'((?<=\w)strasse)|(-str(?!\w))|( str(?!\w))|(-strasse)|(str(?!\w))', ' strasse', normalized)
+    normalized = re.sub(r'((?<=\w)weg)|(-weg)', ' weg', normalized)
+    normalized = re.sub(r'((?<=\w)gasse)|(-gasse)', ' gasse', normalized)
+    normalized = re.sub(r'((?<=\w)gaessle)|(-gaessle)', ' gaessle', normalized)
+    normalized = re.sub(r'((?<=\w)platz)|(-platz)', ' platz', normalized)
+    normalized = re.sub(r'((?<=\w)steige)|(-steige)', ' steige', normalized)
+    normalized = re.sub(r'((?<=\w)ring)|(-ring)', ' ring', normalized)
+    normalized = re.sub(r'((?<!\w)st\.\s)|((?<!\w)sankt\s)', 'sankt ', normalized)
+    return normalized
+
+def timeit(func, *args, repeat=3, setup=None):
+    """Returns the best wall time of repeat calls in seconds
+
+    setup is called untimed before every call, its result is passed as first argument"""
+    best = float('inf')
+    for i in range(repeat):
+        arguments = (setup(),) + args if setup else args
+        begin = perf_counter()
+        func(*arguments)
+        best = min(best, perf_counter() - begin)
+    return best
+
+@contextmanager
+def quiet():
+    """Discards the progress output of the crawlers, it is still formatted and written"""
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        yield
+
+def benchNormalizeName(count):
+    names = getStreetNames(count)
+    if list(map(legacyNormalizeName, names)) != list(map(Street.normalizeName, names)):
+        raise AssertionError('Street.normalizeName differs from the reference implementation')
+    def cold():
+        Street.normalizeName.cache_clear()
+        for name in names:
+            Street.normalizeName(name)
+    def warm():
+        for name in names:
+            Street.normalizeName(name)
+    return {'legacy': timeit(lambda: list(map(legacyNormalizeName, names))),
+            'cold': timeit(cold),
+            'warm': timeit(warm)}
+
+def benchSpatialIndex(count, queries=1000):
+    streets = getStreets(count)
+    rand = Random(1)
+    lats = [rand.uniform(47.9169, 48.0524) for i in range(queries)]
+    lngs = [rand.uniform(7.6676, 7.9327) for i in range(queries)]
+    index = SpatialIndex(streets)
+    segments = list(zip(index.ax, index.ay, index.bx, index.by))
+    xs, ys = index._project(lngs, lats)
+    def bruteForce():
+        for x, y in zip(xs[:10], ys[:10]):
+            min(SpatialIndex._distanceSq(x, y, *segment) for segment in segments)
+    return {'build': timeit(SpatialIndex, streets, repeat=1),
+            'query': timeit(index.nearestMany, lats, lngs) / queries,
+            'bruteForce': timeit(bruteForce, repeat=1) / 10}
+
+def benchStreetsCSV(count):
+    streets = getStreets(count)
+    with TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'streets.csv')
+        writeStreetsCSV(filename, streets)
+        def setup():
+            Street.normalizeName.cache_clear()
+            return filename
+        return {'load': timeit(Street.getStreetsDictFromCSV, setup=setup)}
+
+def benchAws(names, count=52):
+    pages = list(getAwsPages(names, AwsCrawler.alphabet).values())
+    rows = [row for page in pages for row in AwsCrawler.parseRows(page)]
+    # like matched rows, so the events get their deterministic ids
+    for row in rows:
+        row.geoId = str(uuid4())
+    def getCSV(engine):
+        for row in rows:
+            row.getCSV(count, engine)
+    return {'parse': timeit(lambda: [AwsCrawler.parseRows(page) for page in pages]),
+            'schedule.cold': timeit(getCSV, setup=lambda: ScheduleEngine(Date.today(), count)),
+            'schedule.warm': timeit(getCSV, ScheduleEngine(Date.today(), count))}
+
+def benchStreaming(names, trickle=0.05, parts=10):
+    """Serves the largest AWS page in parts trickle seconds apart and times its first and last parsed row
+
+    Checks that the page arrives in several chunks, so its rows are parsed while it downloads"""
+    page = max(getAwsPages(names, AwsCrawler.alphabet).values(), key=len)
+    chunks = []
+    with StubServer({'/search.php': page}, trickle=trickle, trickleSize=-(-len(page) // parts)) as stub:
+        def iterChunks():
+            for chunk in Fetcher(1).iterChunks(stub.url + '/search.php'):
+                chunks.append(chunk)
+                yield chunk
+        begin, first = perf_counter(), None
+        for row in AwsCrawler.iterPageRows(iterChunks()):
+            if first is None:
+                first = perf_counter() - begin
+        last = perf_counter() - begin
+    if len(chunks) < 2:
+        raise AssertionError('a page sent in {} parts arrived as {} chunk'.format(parts, len(chunks)))
+    return {'firstRow': first, 'lastRow': last}
+
+def benchOverpass(names):
+    body = getOverpassXML(names)
+    data = OverpassData.fromBytes(body)
+    ways = [data.getLine(way) for way in range(data.getWayCount())]
+    def getMultilines():
+        multilines = [Multiline() for name in names]
+        for way, line in enumerate(ways):
+            multilines[way * len(names) // len(ways)].addLine(line)
+        return multilines
+    def getWKT(multilines):
+        for multiline in multilines:
+            multiline.getWKT()
+    with quiet():
+        build = timeit(StreetCrawler.getStreetsFromData, data)
+    return {'parse': timeit(OverpassData.fromBytes, body),
+            'streets': build,
+            'line.wkt': timeit(lambda: [line.getWKT() for line in ways]),
+            'multiline.wkt': timeit(getWKT, setup=getMultilines)}
+
+def benchEndToEnd(names, count=52, workers=8, latency=0):
+    """Crawls the streets and the calendar from a StubServer and matches them like wasteMind all"""
+    responses = {'/api/interpreter?data=' + StreetCrawler.osmScript.format(StreetCrawler.freiburg): getOverpassXML(names)}
+    for letter, page in getAwsPages(names, AwsCrawler.alphabet).items():
+        responses['/_intern/search.php?strasse=' + letter] = page
+    runs = []
+    def run(directory):
+        streets = StreetCrawler.getStreets(fetcher=Fetcher(1))
+        rows = AwsCrawler.iterRows(workers)
+        try:
+            writeCollections(Street.getStreetsDict(streets.values()), rows, count,
+                             os.path.join(directory, 'events.csv'), os.path.join(directory, 'streets.csv'))
+        finally:
+            rows.close()
+    def setup():
+        runs.append(TemporaryDirectory())
+        return runs[-1].name
+    urls = AwsCrawler.url, OverpassData.url
+    with StubServer(responses, latency) as stub, quiet():
+        AwsCrawler.url, OverpassData.url = stub.url + '/_intern/search.php?strasse=%s', stub.url + '/api/interpreter?data=%s'
+        try:
+            return {'total': timeit(run, setup=setup)}
+        finally:
+            AwsCrawler.url, OverpassData.url = urls
+            for directory in runs:
+                directory.cleanup()
+
+def benchTiles(names, depth=2, workers=4):
+    """Crawls the streets as 4^depth quadtiles from a StubServer, each tile has its own share of the names
+
+    Also fails one tile and checks that the rerun only fetches that one, the others come from the cache"""
+    script = StreetCrawler.tileScript.format(name=StreetCrawler.freiburg)
+    tiles = OverpassData.getQuadtiles(StreetCrawler.getBoundingBox(), depth)
+    responses = {}
+    for i, tile in enumerate(tiles):
+        tileScript = script.format(**dict(zip('swne', ('{:.7f}'.format(c) for c in tile))))
+        responses['/api/interpreter?data=' + tileScript] = getOverpassXML(names[i::len(tiles)], seed=i, bbox=tile,
+                                                                         firstIds=(10 ** 9 * (i + 1), 10 ** 8 * (i + 1)))
+    failedPath = next(iter(responses))
+    directories = []
+    def getFetcher():
+        directories.append(TemporaryDirectory())
+        return Fetcher(workers, cache=ResponseCache(directories[-1].name))
+    def crawl(fetcher):
+        return StreetCrawler.getData(tiles=depth, fetcher=fetcher, workers=workers)
+    url = OverpassData.url
+    with StubServer(responses) as stub:
+        OverpassData.url = stub.url + '/api/interpreter?data=%s'
+        try:
+            cold = timeit(crawl, setup=getFetcher)
+            fetcher = getFetcher()
+            failedBody = responses.pop(failedPath)
+            try:
+                crawl(fetcher)
+                raise AssertionError('the tiled crawl succeeded without the response of a tile')
+            except TileError as e:
+                if 1 != len(e.errors):
+                    raise AssertionError('{} tiles failed instead of one'.format(len(e.errors)))
+            responses[failedPath] = failedBody
+            del stub.requests[:]
+            rerun = timeit(crawl, fetcher, repeat=1)
+            if [failedPath] != [unquote(path) for path in stub.requests]:
+                raise AssertionError('the rerun fetched {} tiles instead of only the failed one'.format(len(stub.requests)))
+            return {'cold': cold, 'rerun': rerun}
+        finally:
+            OverpassData.url = url
+            for directory in directories:
+                directory.cleanup()
+
+def runAll(scales):
+    """Returns {'benchmark.case@scale': seconds} of all benchmarks at all scales of streets"""
+    results = {}
+    for scale in scales:
+        names = getStreetNames(scale)
+        for bench, cases in (('normalizeName', benchNormalizeName(scale * 10)), ('spatialIndex', benchSpatialIndex(scale)),
+                             ('streetsCSV', benchStreetsCSV(scale)), ('aws', benchAws(names)), ('awsStreaming', benchStreaming(names)),
+                             ('overpass', benchOverpass(names)), ('overpassTiles', benchTiles(names)), ('endToEnd', benchEndToEnd(names))):
+            for case, seconds in cases.items():
+                key = '{}.{}@{}'.format(bench, case, scale)
+                results[key] = seconds
+                print('{:40} {:12.3f} ms'.format(key, seconds * 1e3))
+    return results
+
+def compare(results, baseline, tolerance=1.25):
+    """Prints the ratio of every result to the baseline, returns the keys slower than tolerance times the baseline"""
+    regressions = []
+    for key, seconds in results.items():
+        if key not in baseline:
+            continue
+        ratio = seconds / baseline[key] if baseline[key] else float('inf')
+        if ratio > tolerance:
+            regressions.append(key)
+        print('{:40} {:12.3f} ms {:6.2f}x{}'.format(key, seconds * 1e3, ratio, ' slower' if ratio > tolerance else ''))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the crawlers on synthetic data, offline')
+    parser.add_argument('scales', type=int, nargs='*', default=[1000, 5000], help='numbers of streets to benchmark with')
+    parser.add_argument('--save', metavar='BASELINE', help='write the results as JSON baseline')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare the results to a saved baseline, exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='ratio to the baseline that counts as regression')
+    args = parser.parse_args(argv)
+    results = runAll(args.scales)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'scales': args.scales,
+                       'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        print('Compared to {}:'.format(args.compare))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit('{} benchmarks got slower: {}'.format(len(regressions), ', '.join(regressions)))
+
+if __name__ == '__main__':
+    main()
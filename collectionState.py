@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""CollectionState class to find the collection events changed since the last export
+
+Stores the dates of every distinct schedule once, as day ordinals, and which
+schedules apply to each location. That is enough to rebuild every exported
+event and its deterministic id"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+import atomicFile
+
+
+class CollectionState:
+    def __init__(self, schedules=None, locations=None):
+        """schedules maps schedule ids to [type, ordinals] pairs, locations maps location ids to lists of schedule ids"""
+        self.schedules = schedules or {}
+        self.locations = locations or {}
+    def add(self, locationId, scheduleId, dates):
+        """Records that the schedule with the dates of ScheduleEngine.getDates applies to the location"""
+        scheduleId, locationId = str(scheduleId), str(locationId)
+        if scheduleId not in self.schedules:
+            self.schedules[scheduleId] = [[typ, list(ordinals)] for typ, ordinals in dates]
+        scheduleIds = self.locations.setdefault(locationId, [])
+        if scheduleId not in scheduleIds:
+            scheduleIds.append(scheduleId)
+    def getEvents(self, locationId, since=0):
+        """Returns the set of (type, ordinal) of a location from the ordinal since on"""
+        return {(typ, ordinal) for scheduleId in self.locations.get(locationId, ())
+                for typ, ordinals in self.schedules[scheduleId] for ordinal in ordinals if ordinal >= since}
+    def update(self, current, today):
+        """Takes over the CollectionState of the current export and returns its changes
+
+        The changes are sorted (change, location id, type, ordinal) with change inserted or deleted.
+        Events before today have simply passed and are not reported as deleted"""
+        since = today.toordinal()
+        changes = []
+        for locationId in sorted(set(self.locations) | set(current.locations)):
+            old, new = self.getEvents(locationId, since), current.getEvents(locationId)
+            changes.extend(('inserted', locationId, typ, ordinal) for typ, ordinal in new - old)
+            changes.extend(('deleted', locationId, typ, ordinal) for typ, ordinal in old - new)
+        self.schedules, self.locations = current.schedules, current.locations
+        return sorted(changes, key=lambda c: (c[1], c[3], c[2], c[0]))
+    @classmethod
+    def load(cls, filename):
+        """Returns the saved state or an empty one if there is no file yet"""
+        state = atomicFile.loadJSON(filename, {})
+        return cls(state.get('schedules'), state.get('locations'))
+    def save(self, filename):
+        atomicFile.saveJSON(filename, {'schedules': self.schedules, 'locations': self.locations})
+    @staticmethod
+    def getCSVHeader():
+        return 'event_id,type,date,location_id,change'
@@ -9,11 +9,15 @@ __copyright__ = "Copyright 2015, Jan Vogt"
 __email__ = "jan.vogt@me.com"
 __license__ = "GPLv3"
 
-from overpy import Overpass
-from itertools import chain
 from multiline import Multiline
+from overpassData import OverpassData, OverpassError
+from fetcher import Fetcher
+from urllib.error import URLError
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from line import Line
 from uuid import uuid4
+from time import perf_counter
+import metrics
 
 
 class RegionCrawler:
@@ -41,21 +45,106 @@ class RegionCrawler:
 way(area.a)[highway][name];
 (._;>;);out;"""
     @classmethod
-    def getStreets(cls, region):
-        data = cls.osmScript.format(region)
-        result = Overpass().query(data)
-        nodes = {n.id: (n.lat, n.lon) for n in result.get_nodes()}
+    def getStreets(cls, region, source=None, fetcher=None):
+        """Crawls region or reads the Overpass output file source (e.g. an .osm file)"""
+        data = OverpassData.fromFile(source) if source else OverpassData.query(cls.osmScript.format(OverpassData.escape(region)), fetcher)
+        return cls.getMultilineFromData(data)
+    @staticmethod
+    def getMultilineFromData(data):
         multiline = Multiline()
-        for way in result.get_ways():
-            l = Line()
-            for nId in way._node_ids:
-                l.addPoint(*nodes[nId])
-            multiline.addLine(l)
+        for way in range(data.getWayCount()):
+            multiline.addLine(data.getLine(way))
         return multiline
+    @classmethod
+    def iterBatch(cls, regions, batchSize=10, workers=None, fetcher=None, precision=None, stitch=False, tolerance=None):
+        """Crawls many regions, yields (region, wkt or exception) as soon as each region is done
 
-if __name__ == "__main__":
+        batchSize regions are combined into one Overpass query, if it fails its
+        regions are queried one by one. Geometries are built in a process pool"""
+        fetcher = fetcher or Fetcher()
+        batches = [regions[i:i + batchSize] for i in range(0, len(regions), batchSize)]
+        with ThreadPoolExecutor(max_workers=2) as queries, ProcessPoolExecutor(max_workers=workers) as builders:
+            pending = {queries.submit(cls._queryBatch, batch, fetcher): None for batch in batches}
+            while pending:
+                done = wait(pending, return_when=FIRST_COMPLETED).done
+                for future in done:
+                    region = pending.pop(future)
+                    if region is None:
+                        for region, result in future.result():
+                            if isinstance(result, Exception):
+                                yield region, result
+                            else:
+                                pending[builders.submit(cls._buildWKT, result, precision, stitch, tolerance)] = region
+                    elif future.exception():
+                        yield region, future.exception()
+                    else:
+                        # the builders run in other processes, so they report their time with the result
+                        wkt, seconds = future.result()
+                        metrics.addTime('regions.build', seconds)
+                        metrics.count('regions')
+                        yield region, wkt
+    @classmethod
+    def _queryBatch(cls, regions, fetcher):
+        """Returns a list of (region, OverpassData or exception)"""
+        script = '\n'.join(cls.osmScript.format(OverpassData.escape(region)) + OverpassData.getMarkerStatement(region) for region in regions)
+        try:
+            with metrics.stage('regions.query'):
+                sections = OverpassData.querySections(script, fetcher)
+            if [name for name, data in sections] != list(regions):
+                raise OverpassError('Incomplete result for a combined query')
+        except (OverpassError, URLError) as e:
+            if 1 == len(regions):
+                return [(regions[0], e)]
+            return [result for region in regions for result in cls._queryBatch([region], fetcher)]
+        return [(region, data if data.getWayCount() else LookupError('No streets found'))
+                for region, (name, data) in zip(regions, sections)]
+    @classmethod
+    def _buildWKT(cls, data, precision, stitch, tolerance):
+        """Returns the wkt and the seconds it took to build"""
+        start = perf_counter()
+        multiline = cls.getMultilineFromData(data)
+        multiline.process(stitch, tolerance)
+        return multiline.getWKT(precision), perf_counter() - start
+
+def main(argv=None, prog=None):
+    import argparse
     import sys
-    if 2 > len(sys.argv):
-        print("Usage: ./{} region >> streetfile.csv".format(sys.argv[0]))
-    else:
-        print('{},"{}","{}"'.format(uuid4(), sys.argv[1], RegionCrawler.getStreets(sys.argv[1]).getWKT()))
+    parser = argparse.ArgumentParser(prog=prog, description='Crawls the street geometries of regions from OSM, one csv row per region')
+    parser.add_argument('region', nargs='*')
+    parser.add_argument('--regions-file', help='file with one region name per line')
+    parser.add_argument('--osm', help='read an Overpass output file instead of querying the api, for a single region')
+    parser.add_argument('--batch-size', type=int, default=10, help='regions combined into one Overpass query')
+    parser.add_argument('--workers', type=int, help='processes building the geometries, defaults to the number of cpus')
+    parser.add_argument('--precision', type=int, help='decimals of the coordinates, defaults to {}'.format(Line.precision))
+    parser.add_argument('--stitch', action='store_true', help='merge ways meeting end to end into one line')
+    parser.add_argument('--simplify', type=float, metavar='METRES', help='simplify the lines with this Douglas-Peucker tolerance')
+    metrics.addArguments(parser)
+    args = parser.parse_args(argv)
+    regions = list(args.region)
+    if args.regions_file:
+        with open(args.regions_file, encoding='utf-8') as f:
+            regions.extend(line.strip() for line in f if line.strip())
+    if not regions:
+        parser.error('no region given')
+    with metrics.session(args.metrics, args.profile):
+        if args.osm:
+            multiline = RegionCrawler.getStreets(regions[0], args.osm)
+            if args.stitch or args.simplify:
+                lines, points = multiline.process(args.stitch, args.simplify)
+                print('Saved {} lines and {} vertices ({} bytes of coordinates)'.format(lines, points, 16 * points), file=sys.stderr)
+            print('{},"{}","{}"'.format(uuid4(), regions[0], multiline.getWKT(args.precision)))
+            sys.exit()
+        failures = []
+        for region, result in RegionCrawler.iterBatch(regions, args.batch_size, args.workers, None, args.precision, args.stitch, args.simplify):
+            if isinstance(result, Exception):
+                failures.append((region, result))
+            else:
+                print('{},"{}","{}"'.format(uuid4(), region, result), flush=True)
+        if failures:
+            print('{} of {} regions failed:'.format(len(failures), len(regions)), file=sys.stderr)
+            for region, error in failures:
+                print('  {}: {}'.format(region, error), file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
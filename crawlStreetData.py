@@ -9,10 +9,16 @@ __copyright__ = "Copyright 2015, Jan Vogt"
 __email__ = "jan.vogt@me.com"
 __license__ = "GPLv3"
 
-from overpy import Overpass
-from itertools import chain
 from street import Street
+from streetStore import StreetStore
+from streetState import StreetState
+from overpassData import OverpassData, TileError
+from fetcher import Fetcher
+from responseCache import ResponseCache
+import re
 from line import Line
+import geometryCodec
+import metrics
 
 
 class StreetCrawler:
@@ -101,34 +107,131 @@ class StreetCrawler:
 # </osm-script>"""
     osmScript="""area[name="{}"][boundary=administrative]->.a;
 way(area.a)[highway][name];
+(._;>;);out;"""
+    tileScript="""area[name="{name}"][boundary=administrative]->.a;
+way(area.a)({{s}},{{w}},{{n}},{{e}})[highway][name];
 (._;>;);out;"""
     freiburgBB = 's="47.9169" w="7.6676" n="48.0524" e="7.9327"'
     freiburg = 'Freiburg im Breisgau'
     @classmethod
-    def getStreets(cls):
-        data = cls.osmScript.format(cls.freiburg)
-        result = Overpass().query(data)
-        nodes = {n.id: (n.lat, n.lon) for n in result.get_nodes()}
+    def getStreets(cls, source=None, tiles=None, fetcher=None, workers=2):
+        """Crawls Freiburg or reads the Overpass output file source (e.g. an .osm file)
+
+        With tiles, the bounding box of Freiburg is crawled as 4^tiles quadtiles,
+        throws TileError if some of them fail"""
+        return cls.getStreetsFromData(cls.getData(source, tiles, fetcher, workers))
+    @classmethod
+    def getData(cls, source=None, tiles=None, fetcher=None, workers=2):
+        """Returns the OverpassData getStreets builds the Streets from"""
+        if source:
+            return OverpassData.fromFile(source)
+        if tiles is not None:
+            return OverpassData.queryTiles(cls.tileScript.format(name=cls.freiburg), cls.getBoundingBox(), tiles, fetcher, workers)
+        return OverpassData.query(cls.osmScript.format(cls.freiburg), fetcher)
+    @classmethod
+    def getBoundingBox(cls):
+        """Returns freiburgBB as (s, w, n, e)"""
+        bounds = dict(re.findall(r'(\w)="([-\d.]+)"', cls.freiburgBB))
+        return tuple(float(bounds[k]) for k in 'swne')
+    @staticmethod
+    def getStreetsFromData(data):
         streets = {}
-        for way in result.get_ways():
-            try:
-                name = way.tags['name']
-            except KeyError:
-                continue
-            l = Line()
-            for nId in way._node_ids:
-                l.addPoint(*nodes[nId])
-            try:
-                streets[name].addLine(l)
-            except KeyError:
-                streets[name] = Street(name, l)
-                print("New Street: %s" % streets[name])
+        with metrics.stage('streets.build'):
+            for way, name in enumerate(data.wayNames):
+                if not name:
+                    continue
+                l = data.getLine(way)
+                try:
+                    streets[name].addLine(l)
+                except KeyError:
+                    streets[name] = Street(name, l)
+                    print("New Street: %s" % streets[name])
+        metrics.count('streets', len(streets))
         return streets
+    @staticmethod
+    def processStreets(streets, stitch=False, tolerance=None):
+        """Stitches and simplifies the multilines of the Streets, returns (saved lines, removed vertices)"""
+        lines = points = 0
+        with metrics.stage('streets.process'):
+            for street in streets:
+                savedLines, removedPoints = street.multiline.process(stitch, tolerance)
+                lines, points = lines + savedLines, points + removedPoints
+        metrics.count('streets.removedPoints', points)
+        return lines, points
+    @staticmethod
+    def writeStreets(filename, streets, store=False, fmt='wkt', precision=None):
+        """Writes the Streets to a new csv file or, with store, to a new street store"""
+        if store:
+            with metrics.stage('streets.write'):
+                StreetStore.build(filename, streets, fmt, precision)
+        else:
+            with metrics.stage('streets.write'), open(filename, 'x') as f:
+                f.write('{}\n'.format(Street.getCSVHeader()) + '\n'.join(map(lambda x: x.getCSV(precision, fmt), streets)))
+    @staticmethod
+    def writeDelta(filename, changes, fmt='wkt', precision=None):
+        """Writes the changes of StreetState.update to a new csv file, removed streets have an empty geometry"""
+        with metrics.stage('streets.delta'), open(filename, 'x') as f:
+            f.write(StreetState.getCSVHeader() + '\n')
+            for change, uuid, name, street in changes:
+                geometry = street.getGeometry(fmt, precision) if street else ''
+                f.write('{},"{}","{}",{}\n'.format(uuid, name, geometry, change))
 
-if __name__ == "__main__":
+def main(argv=None, prog=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog=prog, description='Crawls the street geometries of Freiburg from OSM')
+    parser.add_argument('outputfile')
+    addSourceArguments(parser)
+    parser.add_argument('--precision', type=int, help='decimals of the coordinates, defaults to {}'.format(Line.precision))
+    parser.add_argument('--format', choices=geometryCodec.formats, default='wkt', help='encoding of the geometry column')
+    parser.add_argument('--store', action='store_true', help='write an indexed SQLite street store instead of a csv file')
+    parser.add_argument('--state', help='file keeping the street uuids stable between runs')
+    parser.add_argument('--delta', metavar='DELTA_OUTPUT', help='also write the streets added, changed or removed since the last run with --state')
+    metrics.addArguments(parser)
+    args = parser.parse_args(argv)
+    if args.delta and not args.state:
+        parser.error('--delta needs --state')
+    with metrics.session(args.metrics, args.profile):
+        state = StreetState.load(args.state) if args.state else None
+        streets, changes = crawlStreets(args, state)
+        StreetCrawler.writeStreets(args.outputfile, streets.values(), args.store, args.format, args.precision)
+        if args.delta:
+            StreetCrawler.writeDelta(args.delta, changes, args.format, args.precision)
+        if args.state:
+            # only saved once all outputs are written, so a failed run is repeated in full
+            state.save(args.state)
+
+def addSourceArguments(parser, workers=2):
+    """Adds the options of crawlStreets to an ArgumentParser"""
+    parser.add_argument('--osm', help='read an Overpass output file instead of querying the api')
+    parser.add_argument('--tiles', type=int, metavar='DEPTH', help='crawl the bounding box as 4^DEPTH quadtiles')
+    parser.add_argument('--workers', type=int, default=workers, help='number of concurrent downloads')
+    parser.add_argument('--delay', type=float, default=1.0, help='minimal seconds between two requests to the api')
+    parser.add_argument('--cache', default='.cache', help='directory of the response cache')
+    parser.add_argument('--ttl', type=int, default=86400, help='seconds a cached response is used before it is fetched again')
+    parser.add_argument('--stitch', action='store_true', help='merge ways meeting end to end into one line')
+    parser.add_argument('--simplify', type=float, metavar='METRES', help='simplify the lines with this Douglas-Peucker tolerance')
+
+def crawlStreets(args, state=None):
+    """Returns the processed Streets by name for the options of addSourceArguments, exits if tiles fail
+
+    The second value are the changes since the StreetState was saved or None without state"""
     import sys
-    if 2 > len(sys.argv):
-        print("Usage: ./{} outputfile.csv".format(sys.argv[0]))
-    else:
-        with open(sys.argv[1], 'x') as f:
-            f.write('{}\n'.format(Street.getCSVHeader()) + '\n'.join(map(lambda x: x.getCSV(), StreetCrawler.getStreets().values())))
+    fetcher = Fetcher(args.workers, 1800, ResponseCache(args.cache, args.ttl), delay=args.delay)
+    try:
+        data = StreetCrawler.getData(args.osm, args.tiles, fetcher, args.workers)
+    except TileError as e:
+        sys.exit('{}\nRerun to fetch only the failed tiles'.format(e))
+    streets = StreetCrawler.getStreetsFromData(data)
+    changes = None
+    if state is not None:
+        with metrics.stage('streets.state'):
+            changes = state.update(data, streets)
+        print('{} added, {} changed and {} removed streets'.format(*(sum(1 for c in changes if change == c[0]) for change in ('added', 'changed', 'removed'))))
+    if args.stitch or args.simplify:
+        lines, points = StreetCrawler.processStreets(streets.values(), args.stitch, args.simplify)
+        print('Saved {} lines and {} vertices ({} bytes of coordinates)'.format(lines, points, 16 * points))
+    return streets, changes
+
+if __name__ == "__main__":
+    main()
+
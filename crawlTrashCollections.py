@@ -9,56 +9,36 @@ __copyright__ = "Copyright 2015, Jan Vogt"
 __email__ = "jan.vogt@me.com"
 __license__ = "GPLv3"
 
-from urllib.request import urlopen
 from urllib.error import URLError
 from urllib.parse import quote
 from lxml import etree
 import re
 import csv
+import os
 from datetime import date as Date
-from datetime import timedelta as Timedelta
-from itertools import chain, repeat
-from uuid import uuid4
-import sys
+from itertools import chain
+from hashlib import sha1
+from uuid import UUID, uuid4, uuid5
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Full
+from threading import Event
+import argparse
 from street import Street
+from scheduleEngine import ScheduleEngine
+from collectionState import CollectionState
+from streetStore import StreetStore
+import geometryCodec
+from fetcher import Fetcher
+from trigramIndex import TrigramIndex
+from responseCache import ResponseCache
+from time import perf_counter
+import metrics
 
 class AwsRow:
-    days = {'Mo': 0, 'Di': 1, 'Mi': 2, 'Do': 3, 'Fr': 4, 'Sa': 5, 'So': 6}
-    evenOffset = {'u': Timedelta(0), 'g': Timedelta(7)}
-    week = Timedelta(7)
-    twoWeek = Timedelta(14)
-    offsets = {'2015-01-01': '2015-01-02',
-               '2015-01-02': '2015-01-03',
-               '2015-01-06': '2015-01-07',
-               '2015-01-07': '2015-01-08',
-               '2015-01-08': '2015-01-09',
-               '2015-01-09': '2015-01-10',
-               '2015-02-16': '2015-02-17',
-               '2015-02-17': '2015-02-18',
-               '2015-02-18': '2015-02-19',
-               '2015-02-19': '2015-02-20',
-               '2015-02-20': '2015-02-21',
-               '2015-04-03': '2015-04-02',
-               '2015-04-06': '2015-04-07',
-               '2015-04-07': '2015-04-08',
-               '2015-04-08': '2015-04-09',
-               '2015-04-09': '2015-04-10',
-               '2015-04-10': '2015-04-11',
-               '2015-05-01': '2015-05-02',
-               '2015-05-14': '2015-05-15',
-               '2015-05-15': '2015-05-16',
-               '2015-05-25': '2015-05-26',
-               '2015-05-26': '2015-05-27',
-               '2015-05-27': '2015-05-28',
-               '2015-05-28': '2015-05-29',
-               '2015-05-29': '2015-05-30',
-               '2015-06-04': '2015-06-05',
-               '2015-06-05': '2015-06-06',
-               '2015-12-21': '2015-12-19',
-               '2015-12-22': '2015-12-21',
-               '2015-12-23': '2015-12-22',
-               '2015-12-24': '2015-12-23',
-               '2015-12-25': '2015-12-24'}
+    scheduleNamespace = UUID('5d0f7d8e-3b0a-4a39-9d6c-2f5c0a8e41b7')
+    eventNamespace = UUID('0c5d6a3e-8f41-4f7e-b2a9-6e1d3c7f9a52')
+    # first hex digit of the fourth group of a uuid by the first one of the hash
+    _variant = {c: '89ab'[int(c, 16) & 3] for c in '0123456789abcdef'}
     def __init__(self):
         self.street = ''
         self.yardWaste = ''
@@ -71,84 +51,55 @@ class AwsRow:
             (self.street, self.yardWaste, self.residualWaste, self.bioWaste, self.greenBinAndYellowBag)
     def __setattr__(self, name, value):
         self.__dict__[name] = re.sub('\s+', ' ', value).strip()
-    def getCSV(self, count):
-        return '\n'.join('{},"{}","{}",{}'.format(uuid4(), typ, self._getRealIsodate(date.isoformat()), self.geoId) for typ, date in chain(
-                zip(repeat('yard_waste'), self.iterMultibleByDayMonthString(self.yardWaste, Date.today(), count)),
-                zip(repeat('other'), self.iterWeeklyByDayString(self.residualWaste, Date.today(), count)),
-                zip(repeat('organic'), self.iterWeeklyByDayString(self.bioWaste, Date.today(), count)),
-                zip(repeat('paper'), self.iterBiweeklyByDayWeekString(self.greenBinAndYellowBag, Date.today(), count)),
-                zip(repeat('plastic'), self.iterBiweeklyByDayWeekString(self.greenBinAndYellowBag, Date.today(), count))))
-
+    def getCSV(self, count, engine=None):
+        """Returns count events per type from today on, engine may be a ScheduleEngine shared by many rows"""
+        return '\n'.join(self.iterCSV(count, engine))
+    def iterCSV(self, count, engine=None, skip=()):
+        """Yields the lines of getCSV one by one, except for the (type, isodate) pairs in skip"""
+        engine = engine or ScheduleEngine.get(Date.today(), count)
+        # events of unmatched rows have no location to derive a stable id from
+        eventId = self.getEventIds(self.geoId) if self.geoId else lambda *key: uuid4()
+        return ('{},"{}","{}",{}'.format(eventId(typ, date), typ, date, self.geoId) for row, typ, date in engine.getEvents((self,))
+                if (typ, date) not in skip)
     @classmethod
-    def _getRealIsodate(cls, isodate):
-        try:
-            return cls.offsets[isodate]
-        except KeyError:
-            return isodate
-
-    @classmethod
-    def iterWeeklyByDayString(cls, day, dateBegin, count=0):
-        try:
-            date = cls._getNextDateForWeekday(dateBegin, cls.days[day])
-        except KeyError:
-            return
-        n = 0
-        while n < count or count == 0:
-            yield date
-            n += 1
-            date += cls.week
+    def getEventId(cls, ownerId, typ, isodate):
+        """Returns the event id derived from the location or schedule id, the type and the date, equal in every export"""
+        return uuid5(cls.eventNamespace, '{}|{}|{}'.format(ownerId, typ, isodate))
     @classmethod
-    def iterMultibleByDayMonthString(cls, daymonth, dateBegin, count=0):
-        datesStr = daymonth.split(' ')
-        year = dateBegin.year
-        dates = []
-        for dateStr in datesStr:
-            match = re.match('(\d{2}).(\d{2}).', dateStr)
-            if not match:
-                continue
-            day, month = match.group(1, 2)
-            dates.append(Date(year, int(month), int(day)))
-        n = 0
-        if len(dates) == 0:
-          return
-        dates.sort()
-        while True:
-            for date in dates:
-                date = Date(year, int(date.month), int(date.day))
-                if date < dateBegin:
-                    continue
-                yield date
-                n += 1
-                if count != 0 and n >= count:
-                    return
-            year += 1
-    @classmethod
-    def iterBiweeklyByDayWeekString(cls, dayweek, dateBegin, count=0):
-        dayweekArr = dayweek.split('/')
-        if len(dayweekArr) == 1:
-            yield from cls.iterWeeklyByDayString(dayweekArr[0], dateBegin, count)
-            return
-        try:
-          day = cls.days[dayweekArr[0]]
-          calenderWeekOffset = cls.evenOffset[dayweekArr[1]]
-        except KeyError:
-            return
-        nextCorrectWeekDay = cls._getNextDateForWeekday(dateBegin, day)
-        if nextCorrectWeekDay.isocalendar()[1] % 2 == 1:
-          date = nextCorrectWeekDay + calenderWeekOffset
-        else:
-          date = nextCorrectWeekDay + (Timedelta(7) + calenderWeekOffset) % Timedelta(14)
-        n = 0
-        while n < count or count == 0:
-            yield date
-            n += 1
-            date += cls.twoWeek
-    @staticmethod
-    def _getNextDateForWeekday(dateBegin, day):
-        return dateBegin + Timedelta(day - dateBegin.weekday()) % Timedelta(7)
+    def getEventIds(cls, ownerId):
+        """Returns a function of (type, isodate) returning the getEventId of ownerId as string
+
+        The namespace and owner are hashed once and the hash is copied per event, the
+        uuid is formatted from the digest without building a UUID"""
+        prefix = sha1(cls.eventNamespace.bytes + '{}|'.format(ownerId).encode('utf-8'))
+        variant = cls._variant
+        def getEventId(typ, isodate):
+            h = prefix.copy()
+            h.update('{}|{}'.format(typ, isodate).encode('utf-8'))
+            x = h.hexdigest()
+            # version 5 and the RFC 4122 variant, like uuid5
+            return '{}-{}-5{}-{}{}-{}'.format(x[:8], x[8:12], x[13:16], variant[x[16]], x[17:20], x[20:32])
+        return getEventId
+    def getScheduleId(self):
+        """Returns the id of the schedule of this row, equal for all rows with the same collection days"""
+        return uuid5(self.scheduleNamespace, '|'.join(ScheduleEngine.getSignature(self)))
+    def getScheduleCSV(self, count, engine=None):
+        """Like getCSV, but the events belong to the schedule of this row instead of its location"""
+        return '\n'.join(self.iterScheduleCSV(count, engine))
+    def iterScheduleCSV(self, count, engine=None):
+        engine = engine or ScheduleEngine.get(Date.today(), count)
+        scheduleId = self.getScheduleId()
+        eventId = self.getEventIds(scheduleId)
+        return ('{},"{}","{}",{}'.format(eventId(typ, date), typ, date, scheduleId) for row, typ, date in engine.getEvents((self,)))
     @staticmethod
     def getCSVHeader():
         return 'event_id,type,date,location_id'
+    @staticmethod
+    def getScheduleCSVHeader():
+        return 'event_id,type,date,schedule_id'
+    @staticmethod
+    def getScheduleMapCSVHeader():
+        return 'location_id,schedule_id'
 
 class AwsCrawler:
     typeMap = {'Straße': 'street',
@@ -157,85 +108,257 @@ class AwsCrawler:
            'Bio tonne': 'bioWaste',
            'Grüne Tonne Gelber Sack gerade/ungerade Kalenderwoche': 'greenBinAndYellowBag'}
     alphabet = 'abcdefghijklmnopqrstuvwxzyäöüß'
-    offsets = {'2015-01-01': '2015-01-02',
-               '2015-01-02': '2015-01-03',
-               '2015-01-06': '2015-01-07',
-               '2015-01-07': '2015-01-08',
-               '2015-01-08': '2015-01-09',
-               '2015-01-09': '2015-01-10',
-               '2015-02-16': '2015-02-17',
-               '2015-02-17': '2015-02-18',
-               '2015-02-18': '2015-02-19',
-               '2015-02-19': '2015-02-20',
-               '2015-02-20': '2015-02-21',
-               '2015-04-03': '2015-04-02',
-               '2015-04-06': '2015-04-07',
-               '2015-04-07': '2015-04-08',
-               '2015-04-08': '2015-04-09',
-               '2015-04-09': '2015-04-10',
-               '2015-04-10': '2015-04-11',
-               '2015-05-01': '2015-05-02',
-               '2015-05-14': '2015-05-15',
-               '2015-05-15': '2015-05-16',
-               '2015-05-25': '2015-05-26',
-               '2015-05-26': '2015-05-27',
-               '2015-05-27': '2015-05-28',
-               '2015-05-28': '2015-05-29',
-               '2015-05-29': '2015-05-30',
-               '2015-06-04': '2015-06-05',
-               '2015-06-05': '2015-06-06',
-               '2015-12-21': '2015-12-19',
-               '2015-12-22': '2015-12-21',
-               '2015-12-23': '2015-12-22',
-               '2015-12-24': '2015-12-23',
-               '2015-12-25': '2015-12-24'}
+    url = 'http://www.abfallwirtschaft-freiburg.de/_intern/search.php?strasse=%s'
+    @classmethod
+    def getRows(cls, workers=1, fetcher=None):
+        """Throws URLError if download fails
+
+        Fetches the letters with up to workers concurrent requests, rows are returned in alphabet order"""
+        return list(cls.iterRows(workers, fetcher))
+    @classmethod
+    def iterRows(cls, workers=1, fetcher=None, prefetch=256):
+        """Yields the AwsRows in alphabet order while later letters are still downloading, throws URLError if a download fails
+
+        Up to workers letters are fetched and parsed concurrently, each of them buffers at most prefetch rows"""
+        urls = [cls.url % quote(letter) for letter in cls.alphabet]
+        stop = Event()
+        with (fetcher or Fetcher(maxConnections=workers)) as f, ThreadPoolExecutor(max_workers=workers) as executor:
+            queues = [Queue(prefetch) for url in urls]
+            futures = [executor.submit(cls._produceRows, f, url, queue, stop) for url, queue in zip(urls, queues)]
+            try:
+                for future, queue in zip(futures, queues):
+                    while True:
+                        row = queue.get()
+                        if row is None:
+                            break
+                        yield row
+                    # reraises the download error of this letter
+                    future.result()
+            finally:
+                stop.set()
+                for future in futures:
+                    future.cancel()
     @classmethod
-    def getRows(cls):
-        """Throws URLError if download fails"""
-        AwsRows = []
-        for letter in cls.alphabet:
-            with urlopen("http://www.abfallwirtschaft-freiburg.de/_intern/search.php?strasse=%s" % quote(letter)) as resp:
-                respStr = resp.read().decode('utf-8')
-                tree = etree.HTML(respStr)
-                if None == tree:
+    def _produceRows(cls, fetcher, url, queue, stop):
+        try:
+            if not stop.is_set():
+                for row in cls.iterPageRows(fetcher.iterChunks(url)):
+                    if not cls._put(queue, row, stop):
+                        return
+        finally:
+            cls._put(queue, None, stop)
+    @staticmethod
+    def _put(queue, item, stop):
+        """Blocks until the queue takes item, returns False if the consumer stopped in the meantime"""
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+    @classmethod
+    def parseRows(cls, page):
+        """Returns the AwsRows of one search.php result page"""
+        return list(cls.iterPageRows((page,)))
+    @classmethod
+    def iterPageRows(cls, chunks):
+        """Yields the AwsRows of one search.php result page given as chunks of bytes, as soon as each row is complete"""
+        parser = etree.HTMLPullParser(events=('end',), tag='tr', encoding='utf-8')
+        table, header = None, None
+        for chunk in chain(chunks, (None,)):
+            start = perf_counter()
+            try:
+                if chunk is None:
+                    parser.close()
+                else:
+                    parser.feed(chunk)
+            except etree.XMLSyntaxError:
+                # an empty page has no document at all
+                return
+            finally:
+                metrics.addTime('aws.parse', perf_counter() - start)
+            for event, tr in parser.read_events():
+                tbody = tr.getparent()
+                if 'tbody' != tbody.tag or 'table' != tbody.getparent().tag or table not in (None, tbody):
                     continue
-                table = tree.find('body/table/tbody')
-                if None == table:
+                table = tbody
+                cols = [' '.join(col.itertext()) for col in tr]
+                # parsed rows are dropped from the tree, so it never grows beyond one row
+                tr.clear()
+                while tr.getprevious() is not None:
+                    del tbody[0]
+                if header is None:
+                    header = [cls.typeMap[col] for col in cols]
                     continue
-                rows = iter(table)
-                header = [cls.typeMap[' '.join(col.itertext())] for col in next(rows)]
-                for row in rows:
-                    awsRow = AwsRow()
-                    for (i, col) in enumerate(row):
-                        setattr(awsRow, header[i], ' '.join(col.itertext()))
-                    AwsRows.append(awsRow)
-        return AwsRows
+                awsRow = AwsRow()
+                for (i, col) in enumerate(cols):
+                    setattr(awsRow, header[i], col)
+                metrics.count('aws.rows')
+                yield awsRow
 
-if __name__ == '__main__':
-    if(5 != len(sys.argv)):
-        print('Usage: ./{} streets_file events_output used_streets_output NcollectionsFromToday'.format(sys.argv[0]))
-        exit()
-    streets = Street.getStreetsDictFromCSV(sys.argv[1])
-    collectionsF, streetsF = sys.argv[2], sys.argv[3]
-    try:
-        rows = AwsCrawler.getRows()
-    except URLError:
-        print('Failed to download data')
-    else:
-        usedStreets = {}
-        with open(collectionsF, 'x') as f:
-            f.write(AwsRow.getCSVHeader() + '\n')
+def writeCollections(streets, rows, count, eventsFilename, streetsFilename, fmt='wkt', threshold=0.8, scheduleMapFilename=None,
+                     state=None, deltaFilename=None):
+    """Matches the AwsRows to the Streets by normalized name and writes the events and used streets as they stream in
+
+    With scheduleMapFilename, the events are written once per schedule, see --schedule-map.
+    A CollectionState is updated to this export and its changes are written to deltaFilename,
+    their ids are keyed by location, so they only apply to exports without scheduleMapFilename.
+    Returns False and removes the outputs if the rows fail to download"""
+    engine = ScheduleEngine.get(Date.today(), count)
+    current = CollectionState()
+    index = None
+    # only ids are kept, rows, events and streets are written as soon as they are known
+    usedStreets, schedules, scheduleMap = set(), set(), set()
+    # the dates of the rows written per location, several rows can normalize to the same street
+    locationDates = {}
+    fuzzyMatches = 0
+    with open(eventsFilename, 'x') as f, open(streetsFilename, 'x') as streetsFile, \
+            (open(scheduleMapFilename, 'x') if scheduleMapFilename else open(os.devnull, 'w')) as mapFile:
+        f.write((AwsRow.getScheduleCSVHeader() if scheduleMapFilename else AwsRow.getCSVHeader()) + '\n')
+        streetsFile.write(Street.getCSVHeader() + '\n')
+        mapFile.write(AwsRow.getScheduleMapCSVHeader() + '\n')
+        # stage times are summed locally and recorded once, waiting is the time spent waiting for the next row
+        times = dict.fromkeys(('aws.wait', 'normalize', 'match', 'schedule', 'write'), 0.0)
+        counts = dict.fromkeys(('match.exact', 'match.fuzzy', 'match.missing', 'events'), 0)
+        previous = perf_counter()
+        try:
             for row in rows:
+                start = perf_counter()
+                name = Street.normalizeName(row.street)
+                normalized = perf_counter()
                 try:
-                    street = streets[Street.normalizeName(row.street)]
-                    row.geoId = street.uuid
-                    usedStreets[street.uuid] = street
+                    street = streets[name]
+                    counts['match.exact'] += 1
                     # print('Match: ' + street.name + ' & ' + row.street)
                 except KeyError:
-                    # pass
-                    print('Not found: ' + Street.normalizeName(row.street))
-                f.write(row.getCSV(int(sys.argv[4])) + '\n')
-        with open(streetsF, 'x') as f:
-            f.write(Street.getCSVHeader() + '\n')
-            for street in usedStreets.values():
-                f.write(street.getCSV() + '\n')
+                    if index is None:
+                        index = TrigramIndex(streets.keys())
+                    found = index.match(name, threshold)
+                    if found:
+                        street = streets[found[1]]
+                        fuzzyMatches += 1
+                        counts['match.fuzzy'] += 1
+                        print('Fuzzy match: {} -> {} ({:.2f})'.format(row.street, street.name, found[0]))
+                    else:
+                        street = None
+                        counts['match.missing'] += 1
+                        print('Not found: ' + name)
+                matched = perf_counter()
+                # the dates are memoized by the engine, so writing the events below only formats them
+                dates = engine.getDates(row)
+                scheduled = perf_counter()
+                if street:
+                    row.geoId = str(street.uuid)
+                    scheduleId = row.getScheduleId()
+                    if state is not None:
+                        current.add(row.geoId, scheduleId, dates)
+                    if street.uuid not in usedStreets:
+                        usedStreets.add(street.uuid)
+                        streetsFile.write(street.getCSV(fmt=fmt) + '\n')
+                if not scheduleMapFilename:
+                    written = locationDates.setdefault(street.uuid, []) if street else None
+                    # the engine shares the dates of equal schedules, so a row repeating a schedule of its location has nothing new
+                    if written is None or all(d is not dates for d in written):
+                        # each event of a location is written once, its id is derived from location, type and date
+                        skip = {(typ, engine.getIsodate(ordinal)) for d in written for typ, ordinals in d for ordinal in ordinals} if written else ()
+                        if written is not None:
+                            written.append(dates)
+                        for line in row.iterCSV(count, engine, skip):
+                            f.write(line + '\n')
+                            counts['events'] += 1
+                elif street:
+                    if scheduleId not in schedules:
+                        schedules.add(scheduleId)
+                        for line in row.iterScheduleCSV(count, engine):
+                            f.write(line + '\n')
+                            counts['events'] += 1
+                    if (street.uuid, scheduleId) not in scheduleMap:
+                        scheduleMap.add((street.uuid, scheduleId))
+                        mapFile.write('{},{}\n'.format(street.uuid, scheduleId))
+                written = perf_counter()
+                for stage, duration in (('aws.wait', start - previous), ('normalize', normalized - start), ('match', matched - normalized),
+                                        ('schedule', scheduled - matched), ('write', written - scheduled)):
+                    times[stage] += duration
+                previous = written
+        except URLError:
+            failed = True
+        else:
+            failed = False
+        finally:
+            rowCount = counts['match.exact'] + counts['match.fuzzy'] + counts['match.missing']
+            for stage, seconds in times.items():
+                metrics.addTime(stage, seconds, rowCount)
+            for counter, value in counts.items():
+                metrics.count(counter, value)
+    if failed:
+        print('Failed to download data')
+        # like before streaming, a failed crawl leaves no output behind
+        for filename in (eventsFilename, streetsFilename, scheduleMapFilename):
+            if filename:
+                os.remove(filename)
+        return False
+    print('{} fuzzy matches accepted'.format(fuzzyMatches))
+    if scheduleMapFilename:
+        print('{} locations share {} schedules'.format(len(scheduleMap), len(schedules)))
+    if state is not None:
+        changes = state.update(current, engine.dateBegin)
+        print('{} events inserted and {} deleted'.format(sum(1 for c in changes if 'inserted' == c[0]), sum(1 for c in changes if 'deleted' == c[0])))
+        if deltaFilename:
+            with metrics.stage('delta'), open(deltaFilename, 'x') as f:
+                f.write(CollectionState.getCSVHeader() + '\n')
+                eventIds = {}
+                for change, locationId, typ, ordinal in changes:
+                    date = engine.getIsodate(ordinal)
+                    if locationId not in eventIds:
+                        # the changes are sorted by location, older ones are done
+                        eventIds = {locationId: AwsRow.getEventIds(locationId)}
+                    f.write('{},"{}","{}",{},{}\n'.format(eventIds[locationId](typ, date), typ, date, locationId, change))
+    return True
+
+def addOutputArguments(parser):
+    """Adds the outputs and options of writeCollections to an ArgumentParser"""
+    parser.add_argument('events_output')
+    parser.add_argument('used_streets_output')
+    parser.add_argument('NcollectionsFromToday', type=int)
+    parser.add_argument('--format', choices=geometryCodec.formats, default='wkt', help='encoding of the geometry column of the used streets')
+    parser.add_argument('--schedule-map', metavar='MAP_OUTPUT',
+                        help='write the events once per distinct schedule and the location_id to schedule_id mapping to MAP_OUTPUT')
+    parser.add_argument('--threshold', type=float, default=0.8, help='minimal similarity of a fuzzy street match, above 1 disables fuzzy matching')
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Crawls the waste calendar of Freiburg and matches it to streets')
+    parser.add_argument('streets_file', help='streets csv or street store')
+    addOutputArguments(parser)
+    parser.add_argument('--workers', type=int, default=8, help='number of concurrent downloads')
+    parser.add_argument('--cache', default='.cache', help='directory of the response cache')
+    parser.add_argument('--ttl', type=int, default=86400, help='seconds a cached page is used without revalidation')
+    parser.add_argument('--replay', action='store_true', help='build the rows only from cached pages')
+    parser.add_argument('--state', help='file remembering the exported schedules of all locations')
+    parser.add_argument('--delta', metavar='DELTA_OUTPUT', help='also write the events inserted or deleted since the last run with --state')
+    metrics.addArguments(parser)
+    args = parser.parse_args(argv)
+    if args.delta and not args.state:
+        parser.error('--delta needs --state')
+    if args.delta and args.schedule_map:
+        # the delta has event ids of locations, the schedule map export only has those of schedules
+        parser.error('--delta cannot be combined with --schedule-map')
+    with metrics.session(args.metrics, args.profile):
+        run(args)
+
+def run(args):
+    fetcher = Fetcher(args.workers, cache=ResponseCache(args.cache, args.ttl), offline=args.replay)
+    with metrics.stage('streets.load'):
+        streets = StreetStore(args.streets_file) if StreetStore.isStore(args.streets_file) else Street.getStreetsDictFromCSV(args.streets_file)
+    state = CollectionState.load(args.state) if args.state else None
+    rows = AwsCrawler.iterRows(args.workers, fetcher)
+    try:
+        if writeCollections(streets, rows, args.NcollectionsFromToday, args.events_output, args.used_streets_output,
+                            args.format, args.threshold, args.schedule_map, state, args.delta) and state is not None:
+            state.save(args.state)
+    finally:
+        # stops the download threads if matching failed
+        rows.close()
+
+if __name__ == '__main__':
+    main()
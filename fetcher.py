@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""Fetcher class to download urls over pooled keep-alive connections
+
+Keeps one pool of persistent HTTP connections per host, so concurrent crawls
+do not pay a TCP handshake for every request. With a ResponseCache, fresh
+responses are served from disk and stale ones are revalidated"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.error import URLError, HTTPError
+from urllib.parse import urlsplit
+from queue import LifoQueue, Empty, Full
+from threading import Lock
+from time import monotonic, sleep, perf_counter
+import metrics
+
+
+class Fetcher:
+    userAgent = 'WasteMindRCrawler'
+    def __init__(self, maxConnections=8, timeout=60, cache=None, offline=False, delay=0):
+        """offline serves everything from cache and never touches the network,
+        delay is the minimal number of seconds between the start of two requests"""
+        self.maxConnections = maxConnections
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.delay = delay
+        self.nextRequest = 0
+        self.pools = {}
+        self.lock = Lock()
+        self.throttleLock = Lock()
+    def get(self, url):
+        """Returns the body of url as bytes, throws URLError if download fails"""
+        entry = self.cache.load(url) if self.cache else None
+        if self.offline:
+            if not entry:
+                raise URLError('{} is not cached'.format(url))
+            metrics.count('cache.hits')
+            return entry.body
+        if entry and self.cache.isFresh(entry):
+            metrics.count('cache.hits')
+            return entry.body
+        status, headers, body = self.request(url, entry.getValidators() if entry else None)
+        if 304 == status and entry:
+            metrics.count('cache.revalidated')
+            self.cache.touch(entry)
+            return entry.body
+        if 200 != status:
+            raise HTTPError(url, status, 'Unexpected status', headers, None)
+        if self.cache:
+            self.cache.store(url, body, headers)
+        return body
+    def iterChunks(self, url, chunkSize=1 << 16):
+        """Like get, but yields the body in chunks while it downloads"""
+        entry = self.cache.load(url) if self.cache else None
+        if self.offline:
+            if not entry:
+                raise URLError('{} is not cached'.format(url))
+            metrics.count('cache.hits')
+            yield entry.body
+            return
+        if entry and self.cache.isFresh(entry):
+            metrics.count('cache.hits')
+            yield entry.body
+            return
+        # only the time spent in the network counts, not the time the consumer takes per chunk
+        start = perf_counter()
+        pool, conn, resp = self._open(url, entry.getValidators() if entry else None)
+        elapsed = perf_counter() - start
+        try:
+            if 304 == resp.status and entry:
+                resp.read()
+                metrics.count('cache.revalidated')
+                self.cache.touch(entry)
+                yield entry.body
+                return
+            if 200 != resp.status:
+                raise HTTPError(url, resp.status, 'Unexpected status', resp.headers, None)
+            # the chunks are only kept if the whole body has to be cached
+            chunks = [] if self.cache else None
+            while True:
+                start = perf_counter()
+                try:
+                    # read1 returns what has arrived so far, read would wait for chunkSize bytes
+                    chunk = resp.read1(chunkSize)
+                except (HTTPException, OSError) as e:
+                    raise URLError(e)
+                finally:
+                    elapsed += perf_counter() - start
+                if not chunk:
+                    break
+                metrics.count('fetch.bytes', len(chunk))
+                if self.cache:
+                    chunks.append(chunk)
+                yield chunk
+            if self.cache:
+                self.cache.store(url, b''.join(chunks), resp.headers)
+        finally:
+            self._finish(pool, conn, resp)
+            metrics.addTime('fetch', elapsed)
+    def request(self, url, headers=None):
+        """Returns (status, headers, body), throws URLError if the connection fails"""
+        with metrics.stage('fetch'):
+            pool, conn, resp = self._open(url, headers)
+            try:
+                body = resp.read()
+            except (HTTPException, OSError) as e:
+                raise URLError(e)
+            finally:
+                self._finish(pool, conn, resp)
+        metrics.count('fetch.bytes', len(body))
+        return resp.status, resp.headers, body
+    def close(self):
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except Empty:
+                    break
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+    def _throttle(self):
+        with self.throttleLock:
+            wait = self.nextRequest - monotonic()
+            if wait > 0:
+                sleep(wait)
+            self.nextRequest = monotonic() + self.delay
+    def _open(self, url, headers):
+        """Sends the request and returns (pool, connection, response) once the headers are read"""
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {}, **{'User-Agent': self.userAgent})
+        pool = self._getPool(parts.scheme, parts.netloc)
+        if self.delay:
+            self._throttle()
+        metrics.count('fetch.requests')
+        # a pooled connection may have been closed by the server while idle,
+        # so a failure on a reused connection is retried once on a fresh one
+        for attempt in range(2):
+            conn, reused = self._acquire(pool, parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+            except (HTTPException, OSError) as e:
+                conn.close()
+                if reused and 0 == attempt:
+                    continue
+                raise URLError(e)
+            return pool, conn, resp
+    def _finish(self, pool, conn, resp):
+        # only a connection whose response was read completely can be reused
+        if resp.will_close or not resp.isclosed():
+            conn.close()
+        else:
+            self._release(pool, conn)
+    def _getPool(self, scheme, netloc):
+        with self.lock:
+            try:
+                return self.pools[(scheme, netloc)]
+            except KeyError:
+                pool = self.pools[(scheme, netloc)] = LifoQueue(self.maxConnections)
+                return pool
+    def _acquire(self, pool, scheme, netloc):
+        try:
+            return pool.get_nowait(), True
+        except Empty:
+            cls = HTTPSConnection if 'https' == scheme else HTTPConnection
+            return cls(netloc, timeout=self.timeout), False
+    @staticmethod
+    def _release(pool, conn):
+        try:
+            pool.put_nowait(conn)
+        except Full:
+            conn.close()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""Encoders and decoders for (multi)linestring geometries
+
+Supports WKT, hex WKB and a compact quantized encoding: coordinates rounded to
+fixed precision integers, delta encoded, zigzag varint packed and finally
+base64 encoded, prefixed with "Q" to keep it CSV safe"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from array import array
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from struct import pack, unpack_from
+from sys import byteorder
+import re
+from line import Line
+
+formats = ('wkt', 'wkb', 'quantized')
+_wktLinePattern = re.compile(r'\(([^()]*)\)')
+_wkbLineString, _wkbMultiLineString = 2, 5
+
+
+def getFormat(geometry):
+    """Returns the format of an encoded geometry string"""
+    if geometry.startswith('Q'):
+        return 'quantized'
+    if geometry.startswith(('00', '01')) and all(c in '0123456789abcdefABCDEF' for c in geometry[:18]):
+        return 'wkb'
+    return 'wkt'
+
+def decode(geometry):
+    """Returns the Lines of a geometry string in any of the formats"""
+    return {'wkt': decodeWKT, 'wkb': decodeHexWKB, 'quantized': decodeQuantized}[getFormat(geometry)](geometry)
+
+def encode(lines, fmt, precision=None):
+    if 'wkt' == fmt:
+        return encodeWKT(lines, precision)
+    if 'wkb' == fmt:
+        return encodeWKB(lines).hex()
+    if 'quantized' == fmt:
+        return encodeQuantized(lines, precision)
+    raise ValueError('Unknown geometry format {}'.format(fmt))
+
+def encodeWKT(lines, precision=None):
+    fmt = '),('.join(Line.getWKTFormat(len(line), precision) for line in lines)
+    coords = tuple(c for line in lines for c in line.coords)
+    if len(lines) > 1:
+        return 'MULTILINESTRING(({}))'.format(fmt % coords)
+    return 'LINESTRING({})'.format(fmt % coords)
+
+def decodeWKT(wkt):
+    return [Line(map(float, group.replace(',', ' ').split())) for group in _wktLinePattern.findall(wkt)]
+
+def encodeWKB(lines):
+    """Little endian WKB, a LineString for a single line and a MultiLineString otherwise"""
+    if 1 == len(lines):
+        return _encodeWKBLine(lines[0])
+    return pack('<BII', 1, _wkbMultiLineString, len(lines)) + b''.join(map(_encodeWKBLine, lines))
+
+def _encodeWKBLine(line):
+    coords = line.coords
+    if 'little' != byteorder:
+        coords = array('d', coords)
+        coords.byteswap()
+    return pack('<BII', 1, _wkbLineString, len(line)) + coords.tobytes()
+
+def decodeHexWKB(geometry):
+    return decodeWKB(bytes.fromhex(geometry))
+
+def decodeWKB(data):
+    lines, offset = _decodeWKB(data, 0)
+    return lines
+
+def _decodeWKB(data, offset):
+    endian = '<' if 1 == data[offset] else '>'
+    typ, count = unpack_from(endian + 'II', data, offset + 1)
+    offset += 9
+    if _wkbMultiLineString == typ:
+        lines = []
+        for i in range(count):
+            line, offset = _decodeWKB(data, offset)
+            lines.extend(line)
+        return lines, offset
+    if _wkbLineString != typ:
+        raise ValueError('Unsupported WKB geometry type {}'.format(typ))
+    coords = array('d', data[offset:offset + 16 * count])
+    if ('<' == endian) != ('little' == byteorder):
+        coords.byteswap()
+    return [Line(coords)], offset + 16 * count
+
+def encodeQuantized(lines, precision=None):
+    """Layout: varint precision, varint line count, per line varint point count, then the zigzag
+    varint deltas of all lng, lat values as integers in units of 10^-precision"""
+    precision = Line.precision if precision is None else precision
+    scale = 10 ** precision
+    out = bytearray()
+    _putVarint(out, precision)
+    _putVarint(out, len(lines))
+    for line in lines:
+        _putVarint(out, len(line))
+    previous = [0, 0]
+    for line in lines:
+        for i, value in enumerate(line.coords):
+            value = round(value * scale)
+            delta = value - previous[i & 1]
+            previous[i & 1] = value
+            _putVarint(out, (delta << 1) ^ (delta >> 63))
+    return 'Q' + urlsafe_b64encode(bytes(out)).rstrip(b'=').decode('ascii')
+
+def decodeQuantized(geometry):
+    data = urlsafe_b64decode(geometry[1:] + '=' * (-(len(geometry) - 1) % 4))
+    precision, offset = _getVarint(data, 0)
+    lineCount, offset = _getVarint(data, offset)
+    counts = []
+    for i in range(lineCount):
+        count, offset = _getVarint(data, offset)
+        counts.append(count)
+    scale = 10 ** precision
+    previous = [0, 0]
+    lines = []
+    for count in counts:
+        coords = array('d')
+        for i in range(2 * count):
+            zigzag, offset = _getVarint(data, offset)
+            previous[i & 1] += (zigzag >> 1) ^ -(zigzag & 1)
+            coords.append(previous[i & 1] / scale)
+        lines.append(Line(coords))
+    return lines
+
+def _putVarint(out, value):
+    while value > 0x7F:
+        out.append(0x80 | value & 0x7F)
+        value >>= 7
+    out.append(value)
+
+def _getVarint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
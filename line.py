@@ -2,19 +2,94 @@
 
 """Line class to represent an ordered set of coordinates
 
-Provides facilities to export wkt coordinate strings"""
+Points are stored interleaved as lng, lat in one float array. Provides
+facilities to export wkt coordinate strings"""
 
 __author__ = "Jan Vogt"
 __copyright__ = "Copyright 2015, Jan Vogt"
 __email__ = "jan.vogt@me.com"
 __license__ = "GPLv3"
 
+from array import array
+from math import cos, radians
+
 class Line:
-    def __init__(self):
-        self.points = []
+    __slots__ = ('coords',)
+    # Overpass delivers coordinates with 7 decimals
+    precision = 7
+    def __init__(self, coords=None):
+        """coords is an iterable of interleaved lng, lat values"""
+        self.coords = array('d', coords if coords is not None else ())
     def addPoint(self, lat, lng):
-        self.points.append((lng, lat))
-    def getWKT(self):
-        return '({})'.format(','.join(map(lambda x: "{:f} {:f}".format(*x), self.points)))
+        self.coords.append(lng)
+        self.coords.append(lat)
+    def addPoints(self, lats, lngs):
+        coords = array('d', bytes(16 * len(lats)))
+        coords[0::2] = array('d', lngs)
+        coords[1::2] = array('d', lats)
+        self.coords.extend(coords)
+    @property
+    def points(self):
+        return list(zip(self.coords[0::2], self.coords[1::2]))
+    def getWKT(self, precision=None):
+        return '({})'.format(self.getWKTFormat(len(self), precision) % tuple(self.coords))
+    @classmethod
+    def getWKTFormat(cls, count, precision=None):
+        """Returns the %-format string of count points, to format all of them in one go"""
+        point = '%.{0}f %.{0}f'.format(cls.precision if precision is None else precision)
+        return ','.join([point] * count)
+    def reverse(self):
+        coords = self.coords
+        flipped = array('d', bytes(8 * len(coords)))
+        flipped[0::2] = coords[-2::-2]
+        flipped[1::2] = coords[::-2]
+        self.coords = flipped
+    def extend(self, line):
+        """Appends the points of line, skipping its first point if it is the current last one"""
+        skip = 2 if len(self.coords) and self.coords[-2:] == line.coords[:2] else 0
+        self.coords.extend(line.coords[skip:])
+    def getStart(self):
+        return tuple(self.coords[:2])
+    def getEnd(self):
+        return tuple(self.coords[-2:])
+    def simplify(self, tolerance):
+        """Douglas-Peucker simplification with tolerance in metres, returns the number of removed points"""
+        n = len(self)
+        if n < 3:
+            return 0
+        # project to a local equirectangular plane in metres
+        metresPerDegree = 6371008.8 * radians(1)
+        xScale = metresPerDegree * cos(radians(self.coords[1]))
+        xs = [x * xScale for x in self.coords[0::2]]
+        ys = [y * metresPerDegree for y in self.coords[1::2]]
+        keep = bytearray(n)
+        keep[0] = keep[-1] = 1
+        toleranceSq = tolerance * tolerance
+        stack = [(0, n - 1)]
+        while stack:
+            first, last = stack.pop()
+            if last - first < 2:
+                continue
+            x0, y0 = xs[first], ys[first]
+            dx, dy = xs[last] - x0, ys[last] - y0
+            lengthSq = dx * dx + dy * dy
+            # squared distances of all inner points to the segment first-last
+            if lengthSq:
+                distances = [(px - x0 - t * dx) ** 2 + (py - y0 - t * dy) ** 2
+                             for px, py, t in ((px, py, min(1.0, max(0.0, ((px - x0) * dx + (py - y0) * dy) / lengthSq)))
+                                               for px, py in zip(xs[first + 1:last], ys[first + 1:last]))]
+            else:
+                distances = [(px - x0) ** 2 + (py - y0) ** 2 for px, py in zip(xs[first + 1:last], ys[first + 1:last])]
+            farthest = max(range(len(distances)), key=distances.__getitem__)
+            if distances[farthest] > toleranceSq:
+                index = first + 1 + farthest
+                keep[index] = 1
+                stack.append((first, index))
+                stack.append((index, last))
+        coords = self.coords
+        self.coords = array('d', (c for i in range(n) if keep[i] for c in (coords[2 * i], coords[2 * i + 1])))
+        return n - len(self)
+    def __len__(self):
+        return len(self.coords) // 2
     def __str__(self):
-        return str(self.points)
\ No newline at end of file
+        return str(self.points)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""Lightweight run metrics of the crawlers
+
+Stages record their summed wall time and number of calls, counters record
+bytes, rows, ways, nodes and cache hits. Stages running in several threads
+add up, so they can exceed the total run time. A report with the peak RSS and
+the cache hit ratio can be saved as JSON, and a run can be wrapped in
+cProfile and tracemalloc"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+import json
+import sys
+
+_lock = Lock()
+_stages = {}
+_counters = {}
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+@contextmanager
+def stage(name):
+    """Adds the wall time of the with block to the stage name"""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        addTime(name, perf_counter() - start)
+
+def addTime(name, seconds, calls=1):
+    with _lock:
+        try:
+            entry = _stages[name]
+        except KeyError:
+            entry = _stages[name] = [0.0, 0]
+        entry[0] += seconds
+        entry[1] += calls
+
+def count(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def getPeakRSS():
+    """Returns the peak resident set size of this process in bytes or None if it is unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other systems kilobytes
+    return peak if 'darwin' == sys.platform else 1024 * peak
+
+def getReport():
+    with _lock:
+        report = {'stages': {name: {'seconds': round(seconds, 6), 'calls': calls} for name, (seconds, calls) in sorted(_stages.items())},
+                  'counters': dict(sorted(_counters.items()))}
+    hits, requests = report['counters'].get('cache.hits', 0), report['counters'].get('fetch.requests', 0)
+    report['cacheHitRatio'] = hits / (hits + requests) if hits + requests else None
+    report['peakRSS'] = getPeakRSS()
+    return report
+
+def save(filename):
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(getReport(), f, indent=2)
+        f.write('\n')
+
+def addArguments(parser):
+    """Adds the --metrics and --profile options of session to an ArgumentParser"""
+    parser.add_argument('--metrics', metavar='METRICS_OUTPUT', help='write the stage times and counters of the run as JSON')
+    parser.add_argument('--profile', action='store_true', help='profile the run with cProfile and tracemalloc, the results go to stderr')
+
+@contextmanager
+def session(filename=None, profile=False, top=25):
+    """Times the with block as stage total, optionally profiles it and saves the report to filename"""
+    if profile:
+        import cProfile
+        import pstats
+        import tracemalloc
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with stage('total'):
+            yield
+    finally:
+        if profile:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            count('tracemalloc.peak', peak)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(top)
+            print('Top allocations, {} bytes at peak:'.format(peak), file=sys.stderr)
+            for statistic in snapshot.statistics('lineno')[:top]:
+                print(statistic, file=sys.stderr)
+        if filename:
+            save(filename)
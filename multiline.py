@@ -2,32 +2,99 @@
 
 """Multiline Class to represent an multiline geometry
 
-Implements support functions for importing and exporting from WKT"""
+Implements support functions for importing and exporting from WKT, WKB and the
+quantized encoding and for merging and simplifying the lines"""
 
 __author__ = "Jan Vogt"
 __copyright__ = "Copyright 2015, Jan Vogt"
 __email__ = "jan.vogt@geops.de"
 __license__ = "GPLv3"
 
+from line import Line
+import geometryCodec
+
 class Multiline:
+    __slots__ = ('lines', 'wkt')
     def __init__(self, wkt=None):
+        """wkt may be given in any format of geometryCodec, it is only decoded when needed"""
         self.lines = None if wkt else []
-        # import from WKT
-        # until that:
         self.wkt = wkt
     def addLine(self, line):
         if not self.wkt:
             self.lines.append(line)
         else:
             raise
-    def getWKT(self):
+    def stitch(self):
+        """Merges lines meeting end to end where no third line joins, returns the number of saved lines"""
         if not self.lines:
-            return self.wkt
-        if len(self.lines) > 1:
-            self.wkt = 'MULTILINESTRING({})'.format(','.join(map(lambda x: x.getWKT(), self.lines)))
-        else:
-            self.wkt = 'LINESTRING' + self.lines[0].getWKT()
+            return 0
+        ends = {}
+        for line in self.lines:
+            if len(line):
+                ends.setdefault(line.getStart(), []).append(line)
+                ends.setdefault(line.getEnd(), []).append(line)
+        used = set()
+        def follow(line, point):
+            # the one other line ending in point, if exactly two lines meet there
+            touching = ends.get(point, ())
+            if 2 != len(touching):
+                return None
+            other = touching[1] if touching[0] is line else touching[0]
+            return None if id(other) in used else other
+        stitched = []
+        for line in self.lines:
+            if id(line) in used or not len(line):
+                continue
+            used.add(id(line))
+            merged = Line(line.coords)
+            for forward in (True, False):
+                current = line
+                while True:
+                    point = merged.getEnd() if forward else merged.getStart()
+                    other = follow(current, point)
+                    if other is None:
+                        break
+                    used.add(id(other))
+                    # orient the next line to continue from point
+                    part = Line(other.coords)
+                    if (part.getStart() != point) == forward:
+                        part.reverse()
+                    if forward:
+                        merged.extend(part)
+                    else:
+                        part.extend(merged)
+                        merged = part
+                    current = other
+            stitched.append(merged)
+        saved = len(self.lines) - len(stitched)
+        self.lines = stitched
+        return saved
+    def simplify(self, tolerance):
+        """Douglas-Peucker simplification of every line with tolerance in metres, returns the number of removed points"""
+        return sum(line.simplify(tolerance) for line in self.lines or ())
+    def process(self, stitch=False, tolerance=None):
+        """Stitches and/or simplifies the lines, returns (saved lines, removed points)"""
+        return self.stitch() if stitch else 0, self.simplify(tolerance) if tolerance else 0
+    def getPointCount(self):
+        return sum(map(len, self.lines or ()))
+    def getLines(self):
+        if self.lines is None and self.wkt:
+            self.lines = geometryCodec.decode(self.wkt)
+        return self.lines
+    def getWKT(self, precision=None):
+        if not self.lines:
+            if not self.wkt or 'wkt' == geometryCodec.getFormat(self.wkt):
+                return self.wkt
+            self.lines = geometryCodec.decode(self.wkt)
+        self.wkt = geometryCodec.encodeWKT(self.lines, precision)
         self.lines = None
         return self.wkt
+    def getGeometry(self, fmt='wkt', precision=None):
+        """Returns the geometry encoded in fmt, one of geometryCodec.formats"""
+        if 'wkt' == fmt:
+            return self.getWKT(precision)
+        if not self.lines and self.wkt and fmt == geometryCodec.getFormat(self.wkt) and precision is None:
+            return self.wkt
+        return geometryCodec.encode(self.getLines(), fmt, precision)
     def __str__(self):
-        return 'Multiline(wkt="{}", lines="{}")'.format(self.wkt, self.lines)
\ No newline at end of file
+        return 'Multiline(wkt="{}", lines="{}")'.format(self.wkt, self.lines)
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+"""OverpassData class to hold the nodes and ways of an Overpass result in typed arrays
+
+Stream-parses Overpass XML (.osm) or JSON output from a file or response body.
+Node ids and coordinates are kept in arrays, the node lists of the ways in a
+CSR structure (offsets into one array of node ids). Large regions can be
+queried as concurrently fetched quadtiles"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from array import array
+from bisect import bisect_left
+from itertools import repeat
+from io import BytesIO
+from codecs import getincrementaldecoder
+from urllib.parse import quote
+from urllib.error import URLError
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree.ElementTree import iterparse, ParseError
+import json
+import re
+from fetcher import Fetcher
+import metrics
+from line import Line
+
+
+class OverpassError(Exception):
+    pass
+
+class TileError(Exception):
+    """Raised after a tiled query, for the tiles which could not be fetched"""
+    def __init__(self, errors):
+        super().__init__('{} tiles failed: {}'.format(len(errors), '; '.join('{}: {}'.format(t, e) for t, e in errors.items())))
+        self.errors = errors
+
+class OverpassData:
+    url = 'http://overpass-api.de/api/interpreter?data=%s'
+    # type of the derived elements separating the sections of a combined query
+    markerType = 'region'
+    def __init__(self):
+        self.nodeIds = array('q')
+        self.lats = array('d')
+        self.lons = array('d')
+        self.wayIds = array('q')
+        self.wayNames = []
+        self.wayOffsets = array('q', [0])
+        self.wayNodeIds = array('q')
+        self.wayNodeIndices = None
+    def addNode(self, nodeId, lat, lon):
+        self.nodeIds.append(nodeId)
+        self.lats.append(lat)
+        self.lons.append(lon)
+    def addWay(self, wayId, nodeIds, name=''):
+        self.wayIds.append(wayId)
+        self.wayNames.append(name)
+        self.wayNodeIds.extend(nodeIds)
+        self.wayOffsets.append(len(self.wayNodeIds))
+        self.wayNodeIndices = None
+    def getNodeCount(self):
+        return len(self.nodeIds)
+    def getWayCount(self):
+        return len(self.wayIds)
+    def resolve(self):
+        """Maps the node ids of all ways to node indices, -1 for unknown nodes"""
+        self._sortNodes()
+        nodeIds, n = self.nodeIds, len(self.nodeIds)
+        indices = array('q', map(bisect_left, repeat(nodeIds), self.wayNodeIds))
+        for i, (index, nodeId) in enumerate(zip(indices, self.wayNodeIds)):
+            if index == n or nodeIds[index] != nodeId:
+                indices[i] = -1
+        self.wayNodeIndices = indices
+        return self
+    def getLine(self, way):
+        """Returns the Line of the way with index way, skipping unknown nodes"""
+        if self.wayNodeIndices is None:
+            self.resolve()
+        indices = [i for i in self.wayNodeIndices[self.wayOffsets[way]:self.wayOffsets[way + 1]] if -1 != i]
+        line = Line()
+        line.addPoints([self.lats[i] for i in indices], [self.lons[i] for i in indices])
+        return line
+    def _sortNodes(self):
+        # Overpass prints nodes ordered by id, so usually there is nothing to do
+        nodeIds = self.nodeIds
+        if all(a < b for a, b in zip(nodeIds, nodeIds[1:])):
+            return
+        order = sorted(range(len(nodeIds)), key=nodeIds.__getitem__)
+        self.nodeIds = array('q', (nodeIds[i] for i in order))
+        self.lats = array('d', (self.lats[i] for i in order))
+        self.lons = array('d', (self.lons[i] for i in order))
+    @classmethod
+    def query(cls, script, fetcher=None):
+        """Runs an Overpass QL script, throws URLError if download fails"""
+        fetcher = fetcher or Fetcher()
+        url = cls.url % quote(script)
+        try:
+            return cls.fromBytes(fetcher.get(url))
+        except OverpassError:
+            # results of failed (e.g. timed out) queries must not be served from the cache
+            if fetcher.cache:
+                fetcher.cache.remove(url)
+            raise
+    @classmethod
+    def queryTiles(cls, script, bbox, depth, fetcher=None, workers=2, retries=1):
+        """Runs script for every quadtile of bbox (s, w, n, e) and merges the results
+
+        script is formatted with the s, w, n and e of the tile. Tiles are fetched
+        with up to workers concurrent requests, politeness delays are up to the
+        fetcher, as is caching the tiles. Throws TileError if tiles fail, the
+        successful ones stay cached"""
+        fetcher = fetcher or Fetcher(workers)
+        def fetch(tile):
+            for attempt in range(retries + 1):
+                try:
+                    return cls.query(script.format(**dict(zip('swne', ('{:.7f}'.format(c) for c in tile)))), fetcher)
+                except (OverpassError, URLError) as e:
+                    error = e
+            return error
+        tiles = cls.getQuadtiles(bbox, depth)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(fetch, tiles))
+        errors = {tile: result for tile, result in zip(tiles, results) if isinstance(result, Exception)}
+        if errors:
+            raise TileError(errors)
+        return cls.merge(results)
+    @staticmethod
+    def getQuadtiles(bbox, depth):
+        """Splits bbox (s, w, n, e) into 4^depth equal tiles"""
+        south, west, north, east = bbox
+        n = 1 << depth
+        height, width = (north - south) / n, (east - west) / n
+        return [(south + i * height, west + j * width, south + (i + 1) * height, west + (j + 1) * width)
+                for i in range(n) for j in range(n)]
+    @classmethod
+    def merge(cls, datas):
+        """Merges results, nodes and ways contained in several of them are kept once"""
+        merged = cls()
+        nodes, ways = set(), set()
+        for data in datas:
+            for i, nodeId in enumerate(data.nodeIds):
+                if nodeId not in nodes:
+                    nodes.add(nodeId)
+                    merged.addNode(nodeId, data.lats[i], data.lons[i])
+            for i, wayId in enumerate(data.wayIds):
+                if wayId not in ways:
+                    ways.add(wayId)
+                    merged.addWay(wayId, data.wayNodeIds[data.wayOffsets[i]:data.wayOffsets[i + 1]], data.wayNames[i])
+        return merged
+    @classmethod
+    def fromFile(cls, filename):
+        with open(filename, 'rb') as f:
+            return cls.fromStream(f)
+    @classmethod
+    def fromBytes(cls, body):
+        return cls.fromStream(BytesIO(body))
+    @classmethod
+    def fromStream(cls, stream, onMarker=None):
+        """Parses XML or JSON output depending on the first character of stream"""
+        head = stream.read(1)
+        while head and head.isspace():
+            head = stream.read(1)
+        stream = _PrependedStream(head, stream)
+        data = cls()
+        try:
+            with metrics.stage('overpass.decode'):
+                if b'{' == head:
+                    data._parseJSON(stream, onMarker)
+                else:
+                    data._parseXML(stream, onMarker)
+        except (ParseError, ValueError) as e:
+            raise OverpassError('Malformed response: {}'.format(e))
+        data._countElements()
+        return data
+    def _countElements(self):
+        metrics.count('overpass.nodes', self.getNodeCount())
+        metrics.count('overpass.ways', self.getWayCount())
+    @classmethod
+    def querySections(cls, script, fetcher=None):
+        """Runs a script printing several results, each followed by a marker
+        (see getMarkerStatement), returns a list of (marker name, OverpassData)"""
+        fetcher = fetcher or Fetcher()
+        url = cls.url % quote(script)
+        sections = []
+        def onMarker(name, data):
+            data._countElements()
+            sections.append((name, data))
+            return cls()
+        try:
+            cls.fromStream(BytesIO(fetcher.get(url)), onMarker)
+        except OverpassError:
+            if fetcher.cache:
+                fetcher.cache.remove(url)
+            raise
+        return sections
+    @classmethod
+    def getMarkerStatement(cls, name):
+        """Overpass QL statement printing a marker element with tag name"""
+        return 'make {} name="{}";out;'.format(cls.markerType, cls.escape(name))
+    @staticmethod
+    def escape(value):
+        """Escapes value for use in a quoted Overpass QL string"""
+        return value.replace('\\', '\\\\').replace('"', '\\"')
+    def _parseXML(self, stream, onMarker=None):
+        """onMarker(name, data) is called for section markers and returns the OverpassData to continue in"""
+        data, root, nds, name = self, None, [], ''
+        for event, elem in iterparse(stream, ('start', 'end')):
+            if 'start' == event:
+                if root is None:
+                    root = elem
+                continue
+            tag = elem.tag
+            if 'nd' == tag:
+                nds.append(int(elem.get('ref')))
+            elif 'tag' == tag:
+                if 'name' == elem.get('k'):
+                    name = elem.get('v')
+            elif 'node' == tag:
+                data.addNode(int(elem.get('id')), float(elem.get('lat')), float(elem.get('lon')))
+                root.clear()
+                name = ''
+            elif 'way' == tag:
+                data.addWay(int(elem.get('id')), nds, name)
+                root.clear()
+                nds, name = [], ''
+            elif 'relation' == tag:
+                root.clear()
+                name = ''
+            elif self.markerType == tag and onMarker:
+                data = onMarker(name, data)
+                root.clear()
+                name = ''
+            elif 'remark' == tag and elem.text and 'error' in elem.text:
+                raise OverpassError(elem.text.strip())
+    def _parseJSON(self, stream, onMarker=None):
+        data = self
+        for element in _iterJSONElements(stream):
+            typ = element.get('type')
+            if 'node' == typ:
+                data.addNode(element['id'], element['lat'], element['lon'])
+            elif 'way' == typ:
+                data.addWay(element['id'], element.get('nodes', ()), element.get('tags', {}).get('name', ''))
+            elif self.markerType == typ and onMarker:
+                data = onMarker(element.get('tags', {}).get('name', ''), data)
+    def __str__(self):
+        return 'OverpassData(nodes="{}", ways="{}")'.format(self.getNodeCount(), self.getWayCount())
+
+class _PrependedStream:
+    """Binary stream with some already consumed bytes put back in front"""
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+    def read(self, size=-1):
+        head, self.head = self.head, b''
+        if size < 0:
+            return head + self.stream.read()
+        return head + self.stream.read(max(0, size - len(head)))
+
+def _iterJSONElements(stream, chunkSize=1 << 16):
+    """Yields the objects of the "elements" array one by one, without decoding the whole document"""
+    decoder, utf8 = json.JSONDecoder(), getincrementaldecoder('utf-8')()
+    buf, pos = '', 0
+    def fill():
+        nonlocal buf, pos
+        data = stream.read(chunkSize)
+        buf = buf[pos:] + utf8.decode(data, not data)
+        pos = 0
+        return bool(data)
+    while -1 == buf.find('"elements"'):
+        if not fill():
+            return
+    pos = buf.find('"elements"') + len('"elements"')
+    while True:
+        pos = _skip(buf, pos, ' \t\r\n:[,')
+        if pos == len(buf):
+            if fill():
+                continue
+            break
+        if ']' == buf[pos]:
+            break
+        try:
+            element, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if fill():
+                continue
+            raise
+        yield element
+    remark = _remarkPattern.search(buf[pos:] + utf8.decode(stream.read(), True))
+    if remark and 'error' in remark.group(1):
+        raise OverpassError(json.loads(remark.group(1)))
+
+_remarkPattern = re.compile(r'"remark"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+def _skip(buf, pos, chars):
+    while pos < len(buf) and buf[pos] in chars:
+        pos += 1
+    return pos
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+"""ResponseCache class to persist downloaded responses on disk
+
+Bodies are stored zlib compressed and keyed by url, together with the ETag and
+Last-Modified headers needed to revalidate them"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from hashlib import sha1
+from time import time
+import json
+import zlib
+import os
+import atomicFile
+
+
+class CacheEntry:
+    def __init__(self, url, body, etag=None, lastModified=None, fetched=0):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.lastModified = lastModified
+        self.fetched = fetched
+    def getAge(self):
+        return time() - self.fetched
+    def getValidators(self):
+        """Returns the headers for a conditional request"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.lastModified:
+            headers['If-Modified-Since'] = self.lastModified
+        return headers
+    def __str__(self):
+        return 'CacheEntry(url="{}", etag="{}", lastModified="{}", fetched="{}")'.format(self.url, self.etag, self.lastModified, self.fetched)
+
+class ResponseCache:
+    """Entries younger than ttl seconds are fresh, older ones have to be revalidated"""
+    def __init__(self, directory, ttl=86400):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+    def load(self, url):
+        """Returns the CacheEntry for url or None"""
+        path = self._getPath(url)
+        try:
+            with open(path + '.json', 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(path + '.z', 'rb') as f:
+                body = zlib.decompress(f.read())
+        except (OSError, ValueError, zlib.error):
+            return None
+        if meta.get('url') != url:
+            return None
+        return CacheEntry(url, body, meta.get('etag'), meta.get('lastModified'), meta.get('fetched', 0))
+    def store(self, url, body, headers=None):
+        headers = headers or {}
+        entry = CacheEntry(url, body, headers.get('ETag'), headers.get('Last-Modified'), time())
+        path = self._getPath(url)
+        atomicFile.write(path + '.z', zlib.compress(body, 9))
+        self._writeMeta(path, entry)
+        return entry
+    def touch(self, entry):
+        """Marks entry as revalidated now"""
+        entry.fetched = time()
+        self._writeMeta(self._getPath(entry.url), entry)
+    def remove(self, url):
+        path = self._getPath(url)
+        for suffix in ('.json', '.z'):
+            try:
+                os.unlink(path + suffix)
+            except FileNotFoundError:
+                pass
+    def isFresh(self, entry):
+        return entry.getAge() < self.ttl
+    def _writeMeta(self, path, entry):
+        meta = {'url': entry.url, 'etag': entry.etag, 'lastModified': entry.lastModified, 'fetched': entry.fetched}
+        atomicFile.write(path + '.json', json.dumps(meta).encode('utf-8'))
+    def _getPath(self, url):
+        return os.path.join(self.directory, sha1(url.encode('utf-8')).hexdigest())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""ScheduleEngine class to compute the collection dates of AwsRows
+
+Dates are computed as day ordinals for whole schedule strings at once and
+shared by all rows with the same string. Holiday shifts are read from a data
+file, see collectionShifts.csv"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from array import array
+from datetime import date as Date
+from functools import lru_cache
+import csv
+import os
+import re
+
+
+class HolidayShifts:
+    """Day shifts of collections, one array of shifts per year covered by the data file"""
+    defaultFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'collectionShifts.csv')
+    def __init__(self, shifts=None):
+        """shifts is a dict of Date to shifted Date"""
+        shifts = shifts or {}
+        years = [d.year for d in shifts] or [Date.today().year]
+        self.first = Date(min(years), 1, 1).toordinal()
+        self.table = array('b', bytes(Date(max(years) + 1, 1, 1).toordinal() - self.first))
+        for day, shifted in shifts.items():
+            self.table[day.toordinal() - self.first] = shifted.toordinal() - day.toordinal()
+    def shift(self, ordinal):
+        i = ordinal - self.first
+        return ordinal + self.table[i] if 0 <= i < len(self.table) else ordinal
+    @classmethod
+    @lru_cache(maxsize=None)
+    def load(cls, filename=None):
+        """Reads a csv with the columns date and shifted in ISO format"""
+        with open(filename or cls.defaultFile, 'r', encoding='utf-8') as f:
+            return cls({Date(*map(int, row['date'].split('-'))): Date(*map(int, row['shifted'].split('-')))
+                        for row in csv.DictReader(f)})
+
+class ScheduleEngine:
+    days = {'Mo': 0, 'Di': 1, 'Mi': 2, 'Do': 3, 'Fr': 4, 'Sa': 5, 'So': 6}
+    evenOffset = {'u': 0, 'g': 7}
+    _dayMonthPattern = re.compile(r'(\d{2}).(\d{2}).')
+    types = (('yard_waste', 'yardWaste', 'multiple'), ('other', 'residualWaste', 'weekly'), ('organic', 'bioWaste', 'weekly'),
+             ('paper', 'greenBinAndYellowBag', 'biweekly'), ('plastic', 'greenBinAndYellowBag', 'biweekly'))
+    signatureFields = ('yardWaste', 'residualWaste', 'bioWaste', 'greenBinAndYellowBag')
+    def __init__(self, dateBegin, count, shifts=None):
+        """Computes count dates per type from dateBegin on"""
+        self.dateBegin = dateBegin
+        self.begin = dateBegin.toordinal()
+        self.count = count
+        self.shifts = shifts or HolidayShifts.load()
+        self._dates = {}
+        self._schedules = {}
+        self._isodates = {}
+    @classmethod
+    @lru_cache(maxsize=8)
+    def get(cls, dateBegin, count):
+        """Shared engine for the default holiday shifts"""
+        return cls(dateBegin, count)
+    @classmethod
+    def getSignature(cls, row):
+        """Returns the schedule strings of an AwsRow, rows with equal signatures share all dates"""
+        return tuple(getattr(row, field) for field in cls.signatureFields)
+    def getDates(self, row):
+        """Returns a list of (type, tuple of shifted ordinals) of an AwsRow"""
+        signature = self.getSignature(row)
+        try:
+            return self._schedules[signature]
+        except KeyError:
+            schedule = self._schedules[signature] = [(typ, self.getOrdinals(kind, getattr(row, field))) for typ, field, kind in self.types]
+            return schedule
+    def getEvents(self, rows):
+        """Yields (row, type, isodate) for all events of all rows"""
+        isodate = self.getIsodate
+        for row in rows:
+            for typ, ordinals in self.getDates(row):
+                for ordinal in ordinals:
+                    yield row, typ, isodate(ordinal)
+    def getOrdinals(self, kind, value):
+        """Returns the shifted ordinals of a schedule string of kind weekly, biweekly or multiple"""
+        try:
+            return self._dates[(kind, value)]
+        except KeyError:
+            shift = self.shifts.shift
+            dates = self._dates[(kind, value)] = tuple(map(shift, getattr(self, '_' + kind)(value)))
+            return dates
+    def getIsodate(self, ordinal):
+        try:
+            return self._isodates[ordinal]
+        except KeyError:
+            isodate = self._isodates[ordinal] = Date.fromordinal(ordinal).isoformat()
+            return isodate
+    def _nextWeekday(self, day):
+        return self.begin + (day - (self.begin + 6) % 7) % 7
+    def _weekly(self, day):
+        if day not in self.days:
+            return range(0)
+        first = self._nextWeekday(self.days[day])
+        return range(first, first + 7 * self.count, 7)
+    def _biweekly(self, dayweek):
+        dayweek = dayweek.split('/')
+        if 1 == len(dayweek):
+            return self._weekly(dayweek[0])
+        if dayweek[0] not in self.days or dayweek[1] not in self.evenOffset:
+            return range(0)
+        first = self._nextWeekday(self.days[dayweek[0]])
+        offset = self.evenOffset[dayweek[1]]
+        if 1 == Date.fromordinal(first).isocalendar()[1] % 2:
+            first += offset
+        else:
+            first += (7 + offset) % 14
+        return range(first, first + 14 * self.count, 14)
+    def _multiple(self, daymonth):
+        monthDays = sorted((int(m.group(2)), int(m.group(1))) for m in map(self._dayMonthPattern.match, daymonth.split(' ')) if m)
+        ordinals = []
+        if not monthDays:
+            return ordinals
+        # every year contributes at least one date, unless there are only invalid ones
+        for year in range(self.dateBegin.year, self.dateBegin.year + self.count + 5):
+            if len(ordinals) >= self.count:
+                break
+            for month, day in monthDays:
+                try:
+                    ordinal = Date(year, month, day).toordinal()
+                except ValueError:
+                    # e.g. 29.02. in a common year
+                    continue
+                if ordinal >= self.begin:
+                    ordinals.append(ordinal)
+        return ordinals[:self.count]
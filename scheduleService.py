@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+"""Answers next collections queries from memory over HTTP
+
+The calendar rows are loaded once and matched to the streets like
+crawlTrashCollections does. Their dates are kept as sorted day ordinals per
+location and type, so a query is a bisection. Responses are cached until the
+next load, a POST to /reload loads the latest crawl while the old index keeps
+answering.
+
+    GET /collections.json?street=Kaiser-Joseph-Straße&n=5&type=organic
+    GET /collections.ics?location_id=...&n=20"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from array import array
+from bisect import bisect_left
+from datetime import date as Date, datetime, timezone
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import json
+from street import Street
+from scheduleEngine import ScheduleEngine
+from trigramIndex import TrigramIndex
+from crawlTrashCollections import AwsRow, AwsCrawler
+from fetcher import Fetcher
+from responseCache import ResponseCache
+from streetStore import StreetStore
+
+
+class Location:
+    __slots__ = ('locationId', 'name', 'dates')
+    def __init__(self, locationId, name):
+        self.locationId = locationId
+        self.name = name
+        # type to sorted array of day ordinals
+        self.dates = {}
+    def add(self, dates):
+        """Merges the (type, ordinals) of ScheduleEngine.getDates into the dates of this location"""
+        for typ, ordinals in dates:
+            if ordinals:
+                self.dates[typ] = array('l', sorted(set(self.dates.get(typ, ())) | set(ordinals)))
+    def getNext(self, n, since, types=None):
+        """Returns the next n (ordinal, type) from the ordinal since on, only of types if given"""
+        collections = []
+        for typ, ordinals in self.dates.items():
+            if types is None or typ in types:
+                i = bisect_left(ordinals, since)
+                collections.extend((ordinal, typ) for ordinal in ordinals[i:i + n])
+        collections.sort()
+        return collections[:n]
+
+class ScheduleIndex:
+    labels = {'yard_waste': 'Schnittgut', 'other': 'Restmüll', 'organic': 'Bioabfall', 'paper': 'Papier', 'plastic': 'Gelber Sack'}
+    maxCount = 100
+    def __init__(self, streets, rows, count=60, today=None, threshold=0.8, cacheSize=4096):
+        """Matches the AwsRows to the Streets by normalized name and keeps count dates per type from today on
+
+        Rows without a street are only found by their name"""
+        self.engine = ScheduleEngine(today or Date.today(), count)
+        self.loaded = datetime.now(timezone.utc)
+        self.locations, self.names = {}, {}
+        fuzzy = None
+        for row in rows:
+            name = Street.normalizeName(row.street)
+            key = name if name in streets else None
+            if key is None and threshold <= 1:
+                if fuzzy is None:
+                    fuzzy = TrigramIndex(streets.keys())
+                found = fuzzy.match(name, threshold)
+                key = found[1] if found else None
+            if key is None:
+                location = self.names.get(name) or Location(None, row.street)
+            else:
+                street = streets[key]
+                locationId = str(street.uuid)
+                location = self.locations.get(locationId) or Location(locationId, street.name)
+                self.locations[locationId] = location
+                self.names.setdefault(key, location)
+            self.names.setdefault(name, location)
+            location.add(self.engine.getDates(row))
+        self.nameIndex = TrigramIndex(self.names.keys())
+        self.threshold = threshold
+        # a new load builds a new index, which drops all cached responses
+        self.respond = lru_cache(maxsize=cacheSize)(self._respond)
+    def __len__(self):
+        return len(self.locations)
+    def find(self, name):
+        """Returns the Location of a street name, fuzzy matched if it is not known as is, or None"""
+        try:
+            normalized = Street.normalizeName(name)
+        except AttributeError:
+            # too short or no letters at all, no street is called like that
+            return None
+        try:
+            return self.names[normalized]
+        except KeyError:
+            found = self.nameIndex.match(normalized, self.threshold) if self.threshold <= 1 else None
+            return self.names[found[1]] if found else None
+    def _respond(self, path, today):
+        """Returns (status, content type, body) of a GET of path on the ordinal today"""
+        url = urlsplit(path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path not in ('/collections.json', '/collections.ics'):
+            return self._error(404, 'unknown path, use /collections.json or /collections.ics')
+        if 'location_id' in query:
+            location = self.locations.get(query['location_id'])
+        elif 'street' in query:
+            location = self.find(query['street'])
+        else:
+            return self._error(400, 'location_id or street is required')
+        if location is None:
+            return self._error(404, 'unknown location')
+        types = set(query['type'].split(',')) if query.get('type') else None
+        if types and not types <= set(self.labels):
+            return self._error(400, 'type must be some of ' + ','.join(self.labels))
+        try:
+            n = int(query.get('n', 5))
+        except ValueError:
+            return self._error(400, 'n must be a number')
+        collections = location.getNext(max(0, min(n, self.maxCount)), today, types)
+        if url.path.endswith('.ics'):
+            return 200, 'text/calendar; charset=utf-8', self.getICS(location, collections)
+        return 200, 'application/json', self.getJSON(location, collections)
+    def getJSON(self, location, collections):
+        isodate = self.engine.getIsodate
+        return json.dumps({'location_id': location.locationId, 'name': location.name,
+                           'collections': [{'type': typ, 'label': self.labels[typ], 'date': isodate(ordinal)} for ordinal, typ in collections]},
+                          ensure_ascii=False).encode('utf-8')
+    def getICS(self, location, collections):
+        """Returns an iCalendar with one all-day event per collection, the uids are the event ids of the csv export"""
+        stamp = self.loaded.strftime('%Y%m%dT%H%M%SZ')
+        lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//WasteMindRCrawler//Collections//DE',
+                 'X-WR-CALNAME:' + self._escapeText('Abfuhrtermine ' + location.name)]
+        for ordinal, typ in collections:
+            date = Date.fromordinal(ordinal)
+            lines += ['BEGIN:VEVENT', 'UID:{}'.format(AwsRow.getEventId(location.locationId or location.name, typ, date.isoformat())),
+                      'DTSTAMP:' + stamp, 'DTSTART;VALUE=DATE:' + date.strftime('%Y%m%d'),
+                      'SUMMARY:' + self._escapeText(self.labels[typ]), 'END:VEVENT']
+        lines.append('END:VCALENDAR')
+        return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+    @staticmethod
+    def _escapeText(text):
+        return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+    @staticmethod
+    def _error(status, message):
+        return status, 'application/json', json.dumps({'error': message}).encode('utf-8')
+
+class ScheduleService:
+    """Serves the ScheduleIndex returned by load, a POST to /reload replaces it by a new one"""
+    def __init__(self, load, host='127.0.0.1', port=8080):
+        self.load = load
+        self.index = load()
+        self.reloading = Lock()
+        self.server = ThreadingHTTPServer((host, port), self._makeHandler())
+        self.server.daemon_threads = True
+        self.thread = None
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server.server_address[:2]
+    def reload(self):
+        """Loads a new index, queries are answered by the old one until it is complete"""
+        with self.reloading:
+            self.index = self.load()
+        return self.index
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    def __enter__(self):
+        return self.start()
+    def __exit__(self, *exc):
+        self.stop()
+    def _makeHandler(self):
+        service = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+            def do_GET(self):
+                self.send(*service.index.respond(self.path, Date.today().toordinal()))
+            def do_POST(self):
+                if '/reload' != urlsplit(self.path).path:
+                    self.send(*ScheduleIndex._error(404, 'unknown path, use /reload'))
+                    return
+                # request bodies are not expected, but must not stay in the connection
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                try:
+                    index = service.reload()
+                except Exception as e:
+                    # e.g. the calendar could not be downloaded, the old index keeps answering
+                    self.send(*ScheduleIndex._error(503, 'reload failed: {}'.format(e)))
+                    return
+                self.send(200, 'application/json', json.dumps({'locations': len(index), 'names': len(index.names)}).encode('utf-8'))
+            def send(self, status, contentType, body):
+                self.send_response(status)
+                self.send_header('Content-Type', contentType)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        return Handler
+
+def loadIndex(args):
+    """Returns the ScheduleIndex of the streets file and the calendar rows for the options of main"""
+    isStore = StreetStore.isStore(args.streets_file)
+    streets = StreetStore(args.streets_file) if isStore else Street.getStreetsDictFromCSV(args.streets_file)
+    try:
+        rows = AwsCrawler.getRows(args.workers, Fetcher(args.workers, cache=ResponseCache(args.cache, args.ttl), offline=args.replay))
+        return ScheduleIndex(streets, rows, args.count, threshold=args.threshold)
+    finally:
+        if isStore:
+            streets.close()
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Answers next collections queries of the waste calendar over HTTP')
+    parser.add_argument('streets_file', help='streets csv or street store')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('--count', type=int, default=60, help='number of dates per type kept in memory from the load on')
+    parser.add_argument('--threshold', type=float, default=0.8, help='minimal similarity of a fuzzy street match, above 1 disables fuzzy matching')
+    parser.add_argument('--workers', type=int, default=8, help='number of concurrent downloads')
+    parser.add_argument('--cache', default='.cache', help='directory of the response cache')
+    parser.add_argument('--ttl', type=int, default=86400, help='seconds a cached page is used without revalidation')
+    parser.add_argument('--replay', action='store_true', help='build the rows only from cached pages, also on reload')
+    args = parser.parse_args(argv)
+    service = ScheduleService(lambda: loadIndex(args), args.host, args.port)
+    print('Serving {} locations on {}'.format(len(service.index), service.url))
+    try:
+        service.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
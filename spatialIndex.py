@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""SpatialIndex class to look up streets by location
+
+Uniform grid over the line segments of the streets, in a local metric
+projection. Answers nearest street and bounding box queries"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from array import array
+from math import cos, radians, floor, sqrt, inf
+
+
+class SpatialIndex:
+    metresPerDegree = 6371008.8 * radians(1)
+    def __init__(self, streets, cellSize=100.0):
+        """streets is an iterable of Streets, cellSize the grid spacing in metres"""
+        self.streets = []
+        self.cellSize = cellSize
+        self.xScale = None
+        self.ax, self.ay, self.bx, self.by = array('d'), array('d'), array('d'), array('d')
+        self.segmentStreets = array('I')
+        for street in streets:
+            self._addStreet(street)
+        if self.xScale is None:
+            self.xScale = self.metresPerDegree
+        self._buildGrid()
+    def _addStreet(self, street):
+        index = len(self.streets)
+        self.streets.append(street)
+        for line in street.multiline.getLines() or ():
+            if len(line) < 2:
+                continue
+            if self.xScale is None:
+                self.xScale = self.metresPerDegree * cos(radians(line.coords[1]))
+            xs, ys = self._project(line.coords[0::2], line.coords[1::2])
+            self.ax.extend(xs[:-1])
+            self.ay.extend(ys[:-1])
+            self.bx.extend(xs[1:])
+            self.by.extend(ys[1:])
+            self.segmentStreets.extend([index] * (len(xs) - 1))
+    def _project(self, lngs, lats):
+        xScale, yScale = self.xScale, self.metresPerDegree
+        return array('d', [x * xScale for x in lngs]), array('d', [y * yScale for y in lats])
+    def _buildGrid(self):
+        cells = {}
+        size = self.cellSize
+        for i, (ax, ay, bx, by) in enumerate(zip(self.ax, self.ay, self.bx, self.by)):
+            # a segment is registered in every cell its bounding box overlaps
+            for cx in range(floor(min(ax, bx) / size), floor(max(ax, bx) / size) + 1):
+                for cy in range(floor(min(ay, by) / size), floor(max(ay, by) / size) + 1):
+                    try:
+                        cells[(cx, cy)].append(i)
+                    except KeyError:
+                        cells[(cx, cy)] = array('I', [i])
+        self.cells = cells
+        if cells:
+            self.cellBounds = (min(c[0] for c in cells), min(c[1] for c in cells), max(c[0] for c in cells), max(c[1] for c in cells))
+    def getSegmentCount(self):
+        return len(self.segmentStreets)
+    def nearest(self, lat, lng, maxDistance=inf):
+        """Returns (street, distance in metres) of the street nearest to the point or None"""
+        segment, distance = self._nearestSegment(lng * self.xScale, lat * self.metresPerDegree, maxDistance) if self.cells else (-1, inf)
+        if -1 == segment:
+            return None
+        return self.streets[self.segmentStreets[segment]], distance
+    def nearestMany(self, lats, lngs, maxDistance=inf):
+        """Batch version of nearest, returns an array of street indices (-1 if none is found) and one of distances"""
+        indices, distances = array('l'), array('d')
+        xs, ys = self._project(lngs, lats)
+        for x, y in zip(xs, ys):
+            segment, distance = self._nearestSegment(x, y, maxDistance) if self.cells else (-1, inf)
+            indices.append(self.segmentStreets[segment] if -1 != segment else -1)
+            distances.append(distance)
+        return indices, distances
+    def inBoundingBox(self, south, west, north, east):
+        """Returns the streets with a segment inside or crossing the bounding box"""
+        size = self.cellSize
+        (x0, x1), (y0, y1) = self._project((west, east), (south, north))
+        found = set()
+        ax, ay, bx, by = self.ax, self.ay, self.bx, self.by
+        for cx in range(floor(x0 / size), floor(x1 / size) + 1):
+            for cy in range(floor(y0 / size), floor(y1 / size) + 1):
+                for i in self.cells.get((cx, cy), ()):
+                    if self._intersectsBox(ax[i], ay[i], bx[i], by[i], x0, y0, x1, y1):
+                        found.add(self.segmentStreets[i])
+        return [self.streets[i] for i in sorted(found)]
+    def _nearestSegment(self, x, y, maxDistance):
+        size = self.cellSize
+        cx, cy = floor(x / size), floor(y / size)
+        minX, minY, maxX, maxY = self.cellBounds
+        cells, ax, ay, bx, by = self.cells, self.ax, self.ay, self.bx, self.by
+        best, bestSq, maxSq = -1, inf, maxDistance * maxDistance
+        # rings closer than the grid are empty
+        ring = max(0, minX - cx, cx - maxX, minY - cy, cy - maxY)
+        # visit rings of cells around the point until no unvisited cell can be closer than the best match
+        while True:
+            if ring and (ring - 1) * size >= maxDistance:
+                break
+            for cell in self._ring(cx, cy, ring, self.cellBounds):
+                for i in cells.get(cell, ()):
+                    distanceSq = self._distanceSq(x, y, ax[i], ay[i], bx[i], by[i])
+                    if distanceSq < bestSq:
+                        best, bestSq = i, distanceSq
+            if bestSq <= (ring * size) ** 2:
+                break
+            if cx - ring <= minX and cy - ring <= minY and cx + ring >= maxX and cy + ring >= maxY:
+                break
+            ring += 1
+        if bestSq > maxSq:
+            return -1, inf
+        return best, sqrt(bestSq)
+    @staticmethod
+    def _ring(cx, cy, ring, bounds):
+        """Yields the cells at Chebyshev distance ring from (cx, cy) that lie within bounds"""
+        if 0 == ring:
+            yield (cx, cy)
+            return
+        minX, minY, maxX, maxY = bounds
+        xs = range(max(cx - ring, minX), min(cx + ring, maxX) + 1)
+        for y in (cy - ring, cy + ring):
+            if minY <= y <= maxY:
+                for x in xs:
+                    yield (x, y)
+        ys = range(max(cy - ring + 1, minY), min(cy + ring - 1, maxY) + 1)
+        for x in (cx - ring, cx + ring):
+            if minX <= x <= maxX:
+                for y in ys:
+                    yield (x, y)
+    @staticmethod
+    def _distanceSq(x, y, ax, ay, bx, by):
+        dx, dy = bx - ax, by - ay
+        lengthSq = dx * dx + dy * dy
+        t = ((x - ax) * dx + (y - ay) * dy) / lengthSq if lengthSq else 0.0
+        t = 0.0 if t < 0.0 else 1.0 if t > 1.0 else t
+        px, py = ax + t * dx - x, ay + t * dy - y
+        return px * px + py * py
+    @staticmethod
+    def _intersectsBox(ax, ay, bx, by, x0, y0, x1, y1):
+        if max(ax, bx) < x0 or min(ax, bx) > x1 or max(ay, by) < y0 or min(ay, by) > y1:
+            return False
+        if x0 <= ax <= x1 and y0 <= ay <= y1:
+            return True
+        # the segment crosses the box iff the box corners are not all on one side of its line
+        sides = [(bx - ax) * (y - ay) - (by - ay) * (x - ax) for x, y in ((x0, y0), (x0, y1), (x1, y0), (x1, y1))]
+        return min(sides) <= 0 <= max(sides)
@@ -11,6 +11,7 @@ __license__ = "GPLv3"
 
 from uuid import uuid4
 from multiline import Multiline
+from functools import lru_cache
 import re
 import csv
 
@@ -27,10 +28,12 @@ class Street:
             self.multiline = Multiline(nameOrRow[lineOrFields['geometry']])
     def addLine(self, line):
         self.multiline.addLine(line)
-    def getWKT(self):
-        return self.multiline.getWKT()
-    def getCSV(self):
-        return '{},"{}","{}"'.format(self.uuid, self.name, self.getWKT())
+    def getWKT(self, precision=None):
+        return self.multiline.getWKT(precision)
+    def getGeometry(self, fmt='wkt', precision=None):
+        return self.multiline.getGeometry(fmt, precision)
+    def getCSV(self, precision=None, fmt='wkt'):
+        return '{},"{}","{}"'.format(self.uuid, self.name, self.getGeometry(fmt, precision))
     def __str__(self):
         return 'Street(name="{}", multiline="{}", uuid="{}")'.format(self.name, self.multiline, self.uuid)
     @classmethod
@@ -39,21 +42,32 @@ class Street:
             rows = iter(csv.reader(f))
             header = next(rows)
             fields = {'id': header.index('location_id'), 'name': header.index('name'), 'geometry': header.index('geometry')}
-            return {cls.normalizeName(row[fields['name']]): Street(row, fields) for row in csv.reader(f)}
+            return cls.getStreetsDict(Street(row, fields) for row in csv.reader(f))
+    @classmethod
+    def getStreetsDict(cls, streets):
+        """Returns the Streets by normalized name, the last Street of a name wins"""
+        return {cls.normalizeName(street.name): street for street in streets}
+    # normalization rules, compiled once; the hyphenated variants of the suffix
+    # rules are gone since hyphens are already replaced by spaces at that point
+    _umlautTable = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss', '*': '', 'ç': 'c'})
+    _bracketPattern = re.compile(r'\(.*?\)')
+    _namePattern = re.compile(r'.\D+')
+    # a single pass separating all suffixes from the preceding word and expanding
+    # "str" abbreviations, "ring" is skipped where the former gasse/gaessle pass
+    # would have split it in the sequential version
+    _suffixPattern = re.compile(r'(?<=\w)(?=strasse|weg|gasse|gaessle|platz|steige|ring(?!asse|aessle))| ?str(?!\w)')
+    _sanktPattern = re.compile(r'((?<!\w)st\.\s)|((?<!\w)sankt\s)')
+    @staticmethod
+    def _replaceSuffix(match):
+        return ' strasse' if match.group() else ' '
     @staticmethod
+    @lru_cache(maxsize=1 << 16)
     def normalizeName(name):
-        normalized = name.lower().replace('ä', 'ae').replace('ö', 'oe').replace('ü', 'ue').replace('ß', 'ss').replace('*', '').replace(' ab ', '').replace('-', ' ').replace('ç', 'c')
-        normalized = re.sub('\(.*?\)', '', normalized)
-        normalized = re.match('.\D+', normalized).group(0).strip()
-        normalized = re.sub('((?<=\w)strasse)|(-str(?!\w))|( str(?!\w))|(-strasse)|(str(?!\w))', ' strasse', normalized)
-        normalized = re.sub('((?<=\w)weg)|(-weg)', ' weg', normalized)
-        normalized = re.sub('((?<=\w)gasse)|(-gasse)', ' gasse', normalized)
-        normalized = re.sub('((?<=\w)gaessle)|(-gaessle)', ' gaessle', normalized)
-        normalized = re.sub('((?<=\w)platz)|(-platz)', ' platz', normalized)
-        normalized = re.sub('((?<=\w)steige)|(-steige)', ' steige', normalized)
-        normalized = re.sub('((?<=\w)ring)|(-ring)', ' ring', normalized)
-        normalized = re.sub('((?<!\w)st\.\s)|((?<!\w)sankt\s)', 'sankt ', normalized)
-        return normalized
+        normalized = name.lower().translate(Street._umlautTable).replace(' ab ', '').replace('-', ' ')
+        normalized = Street._bracketPattern.sub('', normalized)
+        normalized = Street._namePattern.match(normalized).group(0).strip()
+        normalized = Street._suffixPattern.sub(Street._replaceSuffix, normalized)
+        return Street._sanktPattern.sub('sankt ', normalized)
     @staticmethod
     def getCSVHeader():
         return 'location_id,name,geometry'
\ No newline at end of file
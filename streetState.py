@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""StreetState class to keep street ids stable between crawls
+
+Remembers a uuid and a hash of the ways of every street, so a new crawl can
+reuse the uuids and report which streets were added, changed or removed since
+the last one"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from hashlib import sha1
+from uuid import UUID
+import atomicFile
+
+
+class StreetState:
+    def __init__(self, streets=None):
+        """streets maps names to {'uuid': ..., 'hash': ...}"""
+        self.streets = streets or {}
+    def update(self, data, streets):
+        """Gives the Streets built from the OverpassData their previous uuids and takes over their hashes
+
+        The Streets must still have the Lines of StreetCrawler.getStreetsFromData, one per way in
+        the order of data, so update them before they are processed.
+        Returns the changes as a list of (change, uuid, name, Street or None for removed ones)"""
+        wayIds = {}
+        for way, name in enumerate(data.wayNames):
+            if name:
+                wayIds.setdefault(name, []).append(data.wayIds[way])
+        changes, current = [], {}
+        for name, street in streets.items():
+            # the hash covers the node positions, a moved node does not change the version of its way
+            ways = ('{}:{}'.format(wayId, sha1(name.encode('utf-8') + line.coords.tobytes()).hexdigest()[:16])
+                    for wayId, line in zip(wayIds.get(name, ()), street.multiline.getLines()))
+            streetHash = sha1(' '.join(sorted(ways)).encode('utf-8')).hexdigest()[:16]
+            previous = self.streets.get(name)
+            if previous:
+                street.uuid = UUID(previous['uuid'])
+                if previous['hash'] != streetHash:
+                    changes.append(('changed', street.uuid, name, street))
+            else:
+                changes.append(('added', street.uuid, name, street))
+            current[name] = {'uuid': str(street.uuid), 'hash': streetHash}
+        for name, previous in self.streets.items():
+            if name not in current:
+                changes.append(('removed', UUID(previous['uuid']), name, None))
+        self.streets = current
+        return changes
+    @classmethod
+    def load(cls, filename):
+        """Returns the saved state or an empty one if there is no file yet"""
+        state = atomicFile.loadJSON(filename, {})
+        return cls(state.get('streets'))
+    def save(self, filename):
+        atomicFile.saveJSON(filename, {'streets': self.streets})
+    @staticmethod
+    def getCSVHeader():
+        return 'location_id,name,geometry,change'
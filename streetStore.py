@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""StreetStore class to keep streets in an indexed SQLite file
+
+Streets are looked up by normalized name or uuid, their geometry is only read
+from disk when it is actually used"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from pathlib import Path
+import sqlite3
+import csv
+from street import Street
+from multiline import Multiline
+
+
+class StoredStreet(Street):
+    """Street whose multiline is loaded from its store on first use"""
+    def __init__(self, store, uuid, name):
+        self.store = store
+        self.uuid = uuid
+        self.name = name
+        self._multiline = None
+    @property
+    def multiline(self):
+        if self._multiline is None:
+            self._multiline = Multiline(self.store.getGeometry(self.uuid))
+        return self._multiline
+
+class StreetStore:
+    """Read only mapping of normalized street names to StoredStreets"""
+    schema = '''CREATE TABLE streets (uuid TEXT PRIMARY KEY, name TEXT NOT NULL, normalized TEXT NOT NULL, geometry TEXT);
+CREATE INDEX streets_normalized ON streets (normalized);'''
+    def __init__(self, filename):
+        # as uri, so characters like # or ? in the path are escaped
+        self.db = sqlite3.connect(Path(filename).resolve().as_uri() + '?mode=ro', uri=True, check_same_thread=False)
+    def __getitem__(self, normalizedName):
+        # like the dict of getStreetsDictFromCSV, the last street of a name wins
+        row = self.db.execute('SELECT uuid, name FROM streets WHERE normalized = ? ORDER BY rowid DESC LIMIT 1', (normalizedName,)).fetchone()
+        if row is None:
+            raise KeyError(normalizedName)
+        return StoredStreet(self, *row)
+    def __contains__(self, normalizedName):
+        return None != self.db.execute('SELECT 1 FROM streets WHERE normalized = ?', (normalizedName,)).fetchone()
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(DISTINCT normalized) FROM streets').fetchone()[0]
+    def __iter__(self):
+        return self.keys()
+    def keys(self):
+        return (row[0] for row in self.db.execute('SELECT DISTINCT normalized FROM streets'))
+    def getByUuid(self, uuid):
+        row = self.db.execute('SELECT uuid, name FROM streets WHERE uuid = ?', (str(uuid),)).fetchone()
+        if row is None:
+            raise KeyError(uuid)
+        return StoredStreet(self, *row)
+    def getGeometry(self, uuid):
+        return self.db.execute('SELECT geometry FROM streets WHERE uuid = ?', (str(uuid),)).fetchone()[0]
+    def close(self):
+        self.db.close()
+    @classmethod
+    def build(cls, filename, streets, fmt='wkt', precision=None):
+        """Writes the Streets to a new store file, geometries are encoded in fmt"""
+        db = sqlite3.connect(filename)
+        try:
+            db.executescript(cls.schema)
+            db.executemany('INSERT INTO streets VALUES (?, ?, ?, ?)',
+                           ((str(s.uuid), s.name, Street.normalizeName(s.name), s.getGeometry(fmt, precision)) for s in streets))
+            db.commit()
+        finally:
+            db.close()
+    @classmethod
+    def buildFromCSV(cls, filename, csvFilename):
+        with open(csvFilename, 'r', encoding='utf-8') as f:
+            rows = iter(csv.reader(f))
+            header = next(rows)
+            fields = {'id': header.index('location_id'), 'name': header.index('name'), 'geometry': header.index('geometry')}
+            cls.build(filename, (Street(row, fields) for row in rows))
+    @staticmethod
+    def isStore(filename):
+        with open(filename, 'rb') as f:
+            return b'SQLite format 3\x00' == f.read(16)
+
+if __name__ == '__main__':
+    import sys
+    if 3 > len(sys.argv):
+        print('Usage: ./{} streets.csv streets.sqlite'.format(sys.argv[0]))
+    else:
+        StreetStore.buildFromCSV(sys.argv[2], sys.argv[1])
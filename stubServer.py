@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""Local HTTP server serving canned responses
+
+Stands in for the AWS and Overpass endpoints, so crawls can be run offline"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote, unquote
+from threading import Thread
+from time import sleep
+from hashlib import sha1
+import os
+
+
+class StubServer:
+    """Serves responses[path] for every GET of path (path includes the query string)
+
+    Responses carry an ETag and conditional requests are answered with 304
+
+    latency delays every response by that many seconds to simulate a remote server,
+    with trickle the bodies are sent in parts of trickleSize bytes that many seconds apart"""
+    def __init__(self, responses, latency=0, port=0, trickle=0, trickleSize=1000):
+        self.responses = responses
+        self.latency = latency
+        self.trickle = trickle
+        self.trickleSize = trickleSize
+        self.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._makeHandler())
+        self.server.daemon_threads = True
+        self.thread = None
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    def __enter__(self):
+        return self.start()
+    def __exit__(self, *exc):
+        self.stop()
+    @classmethod
+    def fromDirectory(cls, directory, **kwargs):
+        """Every file in directory is served under its url-unquoted filename, see getFilename"""
+        responses = {}
+        for filename in os.listdir(directory):
+            with open(os.path.join(directory, filename), 'rb') as f:
+                responses[unquote(filename)] = f.read()
+        return cls(responses, **kwargs)
+    @staticmethod
+    def getFilename(path):
+        return quote(path, safe='')
+    def _makeHandler(self):
+        stub = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+            def do_GET(self):
+                stub.requests.append(self.path)
+                if stub.latency:
+                    sleep(stub.latency)
+                body = stub.responses.get(unquote(self.path))
+                if body is None:
+                    self.send_response(404)
+                    body = b''
+                else:
+                    etag = '"{}"'.format(sha1(body).hexdigest())
+                    if self.headers.get('If-None-Match') == etag:
+                        self.send_response(304)
+                        body = b''
+                    else:
+                        self.send_response(200)
+                        self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not stub.trickle:
+                    self.wfile.write(body)
+                    return
+                for i in range(0, len(body), stub.trickleSize):
+                    if i:
+                        sleep(stub.trickle)
+                    self.wfile.write(body[i:i + stub.trickleSize])
+            def log_message(self, *args):
+                pass
+        return Handler
+
+if __name__ == '__main__':
+    import sys
+    if 3 > len(sys.argv):
+        print('Usage: ./{} directory port'.format(sys.argv[0]))
+    else:
+        stub = StubServer.fromDirectory(sys.argv[1], port=int(sys.argv[2]))
+        print('Serving {} on {}'.format(sys.argv[1], stub.url))
+        stub.server.serve_forever()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""Generators for synthetic crawler input
+
+Produces realistic looking data for benchmarks without touching the network:
+street names, Streets and street csv files, AWS search.php result pages and
+Overpass XML results"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from random import Random
+from xml.sax.saxutils import escape, quoteattr
+from line import Line
+from street import Street
+
+namePrefixes = ['Kaiser-Joseph', 'Habsburger', 'Bertold', 'Schwarzwald', 'Wiehre', 'Gerberau', 'Eschholz',
+                'Lehener', 'Basler', 'Belfort', 'Goethe', 'Schiller', 'Hebel', 'Merian', 'Günterstal',
+                'Dreisam', 'Mösle', 'Rosen', 'Linden', 'Kirch', 'Mühlen', 'Bahnhof', 'Schloss', 'Berg',
+                'Wald', 'Garten', 'Sonnen', 'Blumen', 'Eichen', 'Ahorn', 'Tannen', 'Buchen', 'Weiden',
+                'Hohen', 'Ober', 'Unter', 'Mittel', 'Alt', 'Neu', 'Kloster', 'Markt', 'Rathaus', 'Schul',
+                'Friedhof', 'Hauptstraßen', 'Zähringer', 'Herdermer', 'Stühlinger', 'Littenweiler', 'Ebneter']
+nameSuffixes = ['straße', 'str.', 'weg', 'gasse', 'gässle', 'platz', 'steige', 'ring', 'allee', 'matte']
+namePatterns = ['{prefix}{suffix}', '{prefix}{suffix}', '{prefix}{suffix}', '{prefix}-{suffix}',
+                '{prefix} {suffix}', '{prefix}{suffix} {number}', 'Am {prefix}{suffix}', 'Sankt-{prefix}-{suffix}',
+                'St. {prefix}{suffix}', '{prefix}{suffix} ({district})', '{prefix}{suffix} ab {number}']
+districts = ['Herdern', 'Wiehre', 'Zähringen', 'St. Georgen', 'Haslach', 'Betzenhausen', 'Littenweiler']
+awsHeader = ['Straße', 'Schnitt gut', 'Restmüll tonne', 'Bio tonne', 'Grüne Tonne Gelber Sack gerade/ungerade Kalenderwoche']
+weekdays = ['Mo', 'Di', 'Mi', 'Do', 'Fr']
+
+
+def getStreetNames(count, seed=0):
+    """Returns count German street names as they appear in OSM and the AWS calendar"""
+    rand = Random(seed)
+    names = []
+    for i in range(count):
+        pattern = rand.choice(namePatterns)
+        suffix = rand.choice(nameSuffixes)
+        if '-{suffix}' in pattern or ' {suffix}' in pattern:
+            suffix = suffix.capitalize()
+        names.append(pattern.format(prefix=rand.choice(namePrefixes) + rand.choice(['', '', '', 'er', 'en']),
+                                    suffix=suffix, number=rand.randint(1, 200), district=rand.choice(districts)))
+    return names
+
+def getStreets(count, pointsPerStreet=20, seed=0, bbox=(47.9169, 7.6676, 48.0524, 7.9327)):
+    """Returns count Streets, each a random walk of pointsPerStreet points within bbox (s, w, n, e)"""
+    rand = Random(seed)
+    south, west, north, east = bbox
+    names = getStreetNames(count, seed)
+    streets = []
+    for name in names:
+        lat, lng = rand.uniform(south, north), rand.uniform(west, east)
+        lats, lngs = [], []
+        for i in range(pointsPerStreet):
+            # steps of roughly 10 to 50 metres
+            lat += rand.uniform(-0.0004, 0.0004)
+            lng += rand.uniform(-0.0006, 0.0006)
+            lats.append(lat)
+            lngs.append(lng)
+        line = Line()
+        line.addPoints(lats, lngs)
+        streets.append(Street(name, line))
+    return streets
+
+def writeStreetsCSV(filename, streets):
+    """Writes the Streets like crawlStreetData does"""
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('{}\n'.format(Street.getCSVHeader()) + '\n'.join(street.getCSV() for street in streets))
+
+def getSchedules(count, seed=0):
+    """Returns count distinct (yardWaste, residualWaste, bioWaste, greenBinAndYellowBag) strings,
+    real streets share a few dozen of them"""
+    rand = Random(seed)
+    schedules = set()
+    while len(schedules) < count:
+        yard = ' '.join('{:02d}.{:02d}.'.format(rand.randint(1, 28), month) for month in sorted(rand.sample(range(3, 12), rand.randint(2, 4))))
+        schedules.add((yard, rand.choice(weekdays), rand.choice(weekdays), '{}/{}'.format(rand.choice(weekdays), rand.choice('gu'))))
+    return sorted(schedules)
+
+def getAwsPages(names, alphabet, schedules=40, typos=0.05, seed=0):
+    """Returns {letter: search.php result page as bytes} listing the names under their first letter
+
+    A share of typos of the names loses one character, so matching them needs the fuzzy search"""
+    rand = Random(seed)
+    choices = getSchedules(schedules, seed)
+    rows = {letter: [] for letter in alphabet}
+    for name in names:
+        if rand.random() < typos and 4 < len(name):
+            i = rand.randrange(1, len(name))
+            name = name[:i] + name[i + 1:]
+        letter = name[0].lower()
+        rows[letter if letter in rows else alphabet[0]].append((name,) + rand.choice(choices))
+    def getRow(cells):
+        return '<tr>' + ''.join('<td>{}</td>'.format(escape(cell)) for cell in cells) + '</tr>\n'
+    return {letter: ('<html><head><title>Abfuhrtermine</title></head><body>\n<table><tbody>\n' + getRow(awsHeader) +
+                     ''.join(map(getRow, letterRows)) + '</tbody></table>\n</body></html>').encode('utf-8')
+            for letter, letterRows in rows.items()}
+
+def getOverpassXML(names, waysPerStreet=3, nodesPerWay=10, seed=0, bbox=(47.9169, 7.6676, 48.0524, 7.9327), firstIds=(1000000, 100000)):
+    """Returns an Overpass XML result with waysPerStreet ways per name, the ways of a street
+    continue each other and share their end nodes
+
+    Node and way ids count up from firstIds, distinct results need distinct ranges"""
+    rand = Random(seed)
+    south, west, north, east = bbox
+    nodes, ways = [], []
+    nodeId, wayId = firstIds
+    for name in names:
+        lat, lng = rand.uniform(south, north), rand.uniform(west, east)
+        previous = None
+        for way in range(waysPerStreet):
+            nodeIds = [previous] if previous else []
+            while len(nodeIds) < nodesPerWay:
+                lat += rand.uniform(-0.0004, 0.0004)
+                lng += rand.uniform(-0.0006, 0.0006)
+                nodes.append('  <node id="{}" lat="{:.7f}" lon="{:.7f}"/>\n'.format(nodeId, lat, lng))
+                nodeIds.append(nodeId)
+                nodeId += 1
+            previous = nodeIds[-1]
+            ways.append('  <way id="{}">\n{}    <tag k="highway" v="residential"/>\n    <tag k="name" v={}/>\n  </way>\n'.format(
+                wayId, ''.join('    <nd ref="{}"/>\n'.format(i) for i in nodeIds), quoteattr(name)))
+            wayId += 1
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="Overpass API">\n' +
+            ''.join(nodes) + ''.join(ways) + '</osm>\n').encode('utf-8')
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""TrigramIndex class for fuzzy matching of street names
+
+Character trigram inverted index, candidates are scored with the Dice
+coefficient of their trigram sets"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from array import array
+from math import ceil
+from heapq import nlargest
+
+
+class TrigramIndex:
+    def __init__(self, names):
+        self.names = list(names)
+        self.trigrams = [self.getTrigrams(name) for name in self.names]
+        postings = {}
+        for i, trigrams in enumerate(self.trigrams):
+            for trigram in trigrams:
+                try:
+                    postings[trigram].append(i)
+                except KeyError:
+                    postings[trigram] = array('I', [i])
+        self.postings = postings
+        self.sizes = array('I', map(len, self.trigrams))
+    def query(self, name, k=5, threshold=0.0):
+        """Returns up to k (score, name) tuples with score >= threshold, best first"""
+        trigrams = self.getTrigrams(name)
+        if not trigrams or threshold > 1:
+            return []
+        # a name scoring at least threshold shares at least minOverlap trigrams
+        # with the query, so it has to contain one of the rarest
+        # len - minOverlap + 1 query trigrams (prefix filtering), trigrams
+        # unknown to the index are the rarest of all but match nothing
+        known = sorted((t for t in trigrams if t in self.postings), key=lambda t: len(self.postings[t]))
+        minOverlap = max(1, ceil(threshold * len(trigrams) / (2 - threshold)))
+        candidates = set()
+        for trigram in known[:len(known) - minOverlap + 1]:
+            candidates.update(self.postings[trigram])
+        # names too short or too long to reach threshold are skipped unscored
+        minSize, maxSize = minOverlap, len(trigrams) * (2 - threshold) / threshold if threshold else float('inf')
+        sizes = self.sizes
+        scored = ((2 * len(trigrams & self.trigrams[i]) / (len(trigrams) + sizes[i]), i) for i in candidates if minSize <= sizes[i] <= maxSize)
+        return [(score, self.names[i]) for score, i in nlargest(k, scored) if score >= threshold]
+    def match(self, name, threshold):
+        """Returns the best (score, name) with score >= threshold or None"""
+        found = self.query(name, 1, threshold)
+        return found[0] if found else None
+    def __len__(self):
+        return len(self.names)
+    @staticmethod
+    def getTrigrams(name):
+        padded = '  {} '.format(name)
+        return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
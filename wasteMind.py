@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""Single entry point for all crawlers
+
+Each subcommand imports its modules only when it runs. The all command crawls
+the streets from OSM and the waste calendar at the same time and matches them
+in memory, without writing and re-reading a streets csv in between"""
+
+__author__ = "Jan Vogt"
+__copyright__ = "Copyright 2015, Jan Vogt"
+__email__ = "jan.vogt@me.com"
+__license__ = "GPLv3"
+
+from importlib import import_module
+import argparse
+import sys
+import geometryCodec
+import metrics
+
+commands = {'streets': ('crawlStreetData', 'crawl the street geometries of Freiburg from OSM'),
+            'regions': ('crawlRegionStreets', 'crawl the street geometries of regions from OSM'),
+            'collections': ('crawlTrashCollections', 'crawl the waste calendar and match it to a streets file'),
+            'serve': ('scheduleService', 'answer next collections queries from memory over HTTP')}
+
+
+def getParser():
+    parser = argparse.ArgumentParser(description='Crawls street geometries and the waste calendar of Freiburg')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    for name, (module, help) in commands.items():
+        subparsers.add_parser(name, help=help + ', see {} -h'.format(name), add_help=False)
+    allParser = subparsers.add_parser('all', help='crawl the streets and the waste calendar concurrently and match them in memory')
+    allParser.add_argument('events_output')
+    allParser.add_argument('used_streets_output')
+    allParser.add_argument('NcollectionsFromToday', type=int)
+    allParser.add_argument('--streets-output', help='also write all crawled streets to this csv file')
+    allParser.add_argument('--osm', help='read an Overpass output file instead of querying the api')
+    allParser.add_argument('--tiles', type=int, metavar='DEPTH', help='crawl the bounding box as 4^DEPTH quadtiles')
+    allParser.add_argument('--workers', type=int, default=8, help='number of concurrent downloads')
+    allParser.add_argument('--delay', type=float, default=1.0, help='minimal seconds between two requests to the Overpass api')
+    allParser.add_argument('--cache', default='.cache', help='directory of the response cache')
+    allParser.add_argument('--ttl', type=int, default=86400, help='seconds a cached response is used before it is fetched again')
+    allParser.add_argument('--replay', action='store_true', help='build the calendar rows only from cached pages')
+    allParser.add_argument('--stitch', action='store_true', help='merge ways meeting end to end into one line')
+    allParser.add_argument('--simplify', type=float, metavar='METRES', help='simplify the lines with this Douglas-Peucker tolerance')
+    allParser.add_argument('--state', help='file keeping the street uuids stable between runs')
+    allParser.add_argument('--delta', metavar='DELTA_OUTPUT', help='also write the streets added, changed or removed since the last run with --state')
+    allParser.add_argument('--format', choices=geometryCodec.formats, default='wkt', help='encoding of the geometry column of the used streets')
+    allParser.add_argument('--schedule-map', metavar='MAP_OUTPUT',
+                           help='write the events once per distinct schedule and the location_id to schedule_id mapping to MAP_OUTPUT')
+    allParser.add_argument('--threshold', type=float, default=0.8, help='minimal similarity of a fuzzy street match, above 1 disables fuzzy matching')
+    metrics.addArguments(allParser)
+    return parser
+
+def runAll(args):
+    from threading import Thread
+    from itertools import chain
+    from urllib.error import URLError
+    import crawlStreetData
+    import crawlTrashCollections
+    from fetcher import Fetcher
+    from responseCache import ResponseCache
+    from street import Street
+    from streetState import StreetState
+    # Overpass only grants a few slots per client, so OSM keeps its own small worker count
+    streetsArgs = argparse.Namespace(osm=args.osm, tiles=args.tiles, workers=min(args.workers, 2), delay=args.delay,
+                                     cache=args.cache, ttl=args.ttl, stitch=args.stitch, simplify=args.simplify)
+    fetcher = Fetcher(args.workers, cache=ResponseCache(args.cache, args.ttl), offline=args.replay)
+    state = StreetState.load(args.state) if args.state else None
+    awsRows = crawlTrashCollections.AwsCrawler.iterRows(args.workers, fetcher)
+    # the OSM crawl runs in a daemon thread, so a failed calendar download exits right away instead of waiting for it
+    crawling = {}
+    def crawl():
+        try:
+            crawling['result'] = crawlStreetData.crawlStreets(streetsArgs, state)
+        except BaseException as e:
+            crawling['error'] = e
+    crawler = Thread(target=crawl, daemon=True)
+    crawler.start()
+    # closing the rows stops their download threads, whatever made the run end
+    try:
+        # pulling the first row starts the calendar downloads while OSM is still crawled
+        try:
+            rows = chain((next(awsRows),), awsRows)
+        except StopIteration:
+            rows = iter(())
+        except URLError:
+            sys.exit('Failed to download data')
+        crawler.join()
+        if 'error' in crawling:
+            raise crawling['error']
+        streets, changes = crawling['result']
+        if args.streets_output:
+            crawlStreetData.StreetCrawler.writeStreets(args.streets_output, streets.values(), fmt=args.format)
+        if not crawlTrashCollections.writeCollections(Street.getStreetsDict(streets.values()), rows, args.NcollectionsFromToday, args.events_output,
+                                                      args.used_streets_output, args.format, args.threshold, args.schedule_map):
+            sys.exit(1)
+        if args.delta:
+            crawlStreetData.StreetCrawler.writeDelta(args.delta, changes, args.format)
+        if state is not None:
+            # only saved once all outputs are written, so the changes are not lost if the run fails
+            state.save(args.state)
+    finally:
+        awsRows.close()
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = getParser()
+    if argv and argv[0] in commands:
+        # the crawler parses its own arguments, so only its module gets imported
+        import_module(commands[argv[0]][0]).main(argv[1:], '{} {}'.format(parser.prog, argv[0]))
+        return
+    args = parser.parse_args(argv)
+    if 'all' == args.command:
+        if args.delta and not args.state:
+            parser.error('--delta needs --state')
+        with metrics.session(args.metrics, args.profile):
+            runAll(args)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()